@@ -1,13 +1,16 @@
 # app.py
 from flask import render_template, redirect, request, session, url_for, Flask, jsonify
-from flask import send_from_directory
+from flask import Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from datetime import datetime
+import click
+from sqlalchemy import func, or_, and_, update, tuple_
+from datetime import datetime, timedelta
+import base64
+import json
 import os
 import random
 import string
-from werkzeug.utils import secure_filename
 
 from models import init_app, db
 from models.user import User
@@ -17,6 +20,11 @@ from models.product_size import ProductSize
 from models.order import Order
 from models.order_item import OrderItem
 from models.review import Review
+from models import aggregates, archive, catalog_io, instrumentation, inventory, recommendations, sales_rollups, search, stats
+import cache
+import idempotency
+import images
+import metrics
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
@@ -30,6 +38,10 @@ app.secret_key = "Kc5c3zTk'-3<&BdL:P92O{_(:-NkY+KM"
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 init_app(app)
+cache.init_app(app)
+images.init_app(app)
+metrics.init_app(app)
+idempotency.init_app(app)
 
 
 @app.route('/')
@@ -39,7 +51,7 @@ def index():
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return images.send_upload(filename)
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -106,35 +118,303 @@ def user_dashboard():
     return render_template('user/dashboard.html')
 
 
+def product_catalog_query():
+    # One round trip: the cloth type name is joined in and total stock is
+    # read from the product row (see models/aggregates.py)
+    return db.session.query(
+        Product,
+        ClothType.type_name,
+        Product.total_stock
+    ).outerjoin(ClothType, ClothType.id == Product.cloth_type_id) \
+        .order_by(Product.id)
+
+
 @app.route('/get_products')
+@cache.conditional
+@cache.cached('catalog')
 def get_products():
-    from models.product import Product
-    from models.cloth_type import ClothType
-    from models.product_size import ProductSize
-    from sqlalchemy import func
+    product_data = [{
+        'id': p.id,
+        'name': p.name,
+        'price': p.price,
+        'image_url': p.image_url,
+        'image_variants': images.variant_urls(p.image_url),
+        'cloth_type': cloth_type_name or "N/A",
+        'total_stock': total_stock
+    } for p, cloth_type_name, total_stock in product_catalog_query().all()]
+
+    return jsonify(product_data)
+
+
+# ---------------- Keyset pagination ----------------
+def encode_cursor(*values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, *types):
+    # Returns the decoded values, or None if the cursor is malformed
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return [t(v) for t, v in zip(types, values, strict=True)]
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_after(column, value, id_column, last_id, descending=False):
+    # Rows strictly after (value, last_id) in the (column, id) sort order.
+    # The outer <= / >= lets SQLite turn it into an index range.
+    if descending:
+        return and_(column <= value, or_(column < value, id_column < last_id))
+    return and_(column >= value, or_(column > value, id_column > last_id))
+
+
+def page_limit(default=24, maximum=100):
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, maximum))
+
+
+def keyset_page(query, id_column, column=None, value_type=None, descending=False, limit=24):
+    """(rows, next_cursor) for one page of model rows sorted by (column, id), or by id alone.
+
+    Returns None if the request's cursor is malformed.
+    """
+    order = [id_column] if column is None else [column, id_column]
+    cursor = request.args.get('cursor')
+    if cursor:
+        decoded = decode_cursor(cursor, *([int] if column is None else [value_type, int]))
+        if decoded is None:
+            return None
+        if column is None:
+            query = query.filter(id_column < decoded[0] if descending else id_column > decoded[0])
+        else:
+            query = query.filter(keyset_after(column, decoded[0], id_column, decoded[1], descending))
+
+    rows = query.order_by(*[c.desc() if descending else c for c in order]).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*[getattr(rows[-1], c.key) for c in order])
+    return rows, next_cursor
+
+
+def page_url(endpoint, next_cursor):
+    # The same listing with the current filters, one page on
+    if next_cursor is None:
+        return None
+    return url_for(endpoint, **dict(request.args.to_dict(), cursor=next_cursor))
+
+
+def filtered_orders(model=Order):
+    """Orders filtered by ?status=, ?user_id=, ?date_from= and ?date_to= (YYYY-MM-DD).
+
+    ``model`` is Order or archive.ArchivedOrder, which share their columns.
+    """
+    query = model.query
+    status = request.args.get('status', '').strip().lower()
+    if status:
+        query = query.filter(func.lower(func.trim(model.status)) == status)
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        query = query.filter(model.user_id == user_id)
+    date_from = request.args.get('date_from', type=datetime.fromisoformat)
+    if date_from is not None:
+        query = query.filter(model.order_date >= date_from)
+    date_to = request.args.get('date_to', type=datetime.fromisoformat)
+    if date_to is not None:
+        query = query.filter(model.order_date < date_to + timedelta(days=1))
+    return query
+
+
+def orders_page(orders_query, limit):
+    """Newest-first keyset page over hot and archived orders; None for a bad cursor.
+
+    ``orders_query(model)`` builds the filtered query for either table.
+    Archived rows are only fetched once the page reaches back to the newest
+    archived match, which is one index lookup to find.
+    """
+    page = keyset_page(orders_query(Order), Order.id, Order.order_date, datetime.fromisoformat,
+                       descending=True, limit=limit)
+    if page is None:
+        return None
+    rows, next_cursor = page
+    archived_query = orders_query(archive.ArchivedOrder)
+    newest = archive.newest_archived(archived_query)
+    if newest is None or (next_cursor is not None and rows[-1].order_date > newest):
+        return page
+
+    archived, archived_cursor = keyset_page(
+        archived_query, archive.ArchivedOrder.id, archive.ArchivedOrder.order_date, datetime.fromisoformat,
+        descending=True, limit=limit)
+    merged = sorted(rows + archived, key=lambda o: (o.order_date, o.id), reverse=True)
+    more = next_cursor is not None or archived_cursor is not None or len(merged) > limit
+    merged = merged[:limit]
+    return merged, encode_cursor(merged[-1].order_date, merged[-1].id) if more else None
+
+
+def admin_orders_page():
+    return orders_page(filtered_orders, page_limit(default=50, maximum=200))
+
+
+def filtered_users():
+    """Users filtered by ?role= and ?email= (a prefix)."""
+    from models.user import User
+
+    query = User.query
+    role = request.args.get('role', '').strip()
+    if role:
+        query = query.filter(User.role == role)
+    email = request.args.get('email', '').strip()
+    if email:
+        # A range on the unique email index instead of LIKE, which cannot use it
+        query = query.filter(User.email >= email, User.email < email + '\uffff')
+    return query
+
+
+def admin_users_page():
+    # Newest first
+    return keyset_page(filtered_users(), User.id, descending=True, limit=page_limit(default=50, maximum=200))
 
-    products = Product.query.all()
-    product_data = []
 
-    for p in products:
-        # Manually get cloth_type name
-        cloth_type = ClothType.query.filter_by(id=p.cloth_type_id).first()
-        cloth_type_name = cloth_type.type_name if cloth_type else "N/A"
+def json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
 
-        # Get total stock from ProductSize table
-        total_stock = db.session.query(func.sum(ProductSize.stock)) \
-                          .filter(ProductSize.product_id == p.id).scalar() or 0
 
-        product_data.append({
+def stream_json(rows, fmt='json', chunk_rows=500):
+    """Response that writes dict rows as a JSON array or NDJSON while they are read.
+
+    Pair with a yield_per query so neither the rows nor the body is ever held
+    in memory at once.
+    """
+    def generate():
+        parts = ['[' if fmt == 'json' else '']
+        for count, row in enumerate(rows):
+            encoded = json.dumps(row, default=json_value)
+            if fmt == 'ndjson':
+                parts.append(encoded + '\n')
+            else:
+                parts.append(encoded if count == 0 else ',' + encoded)
+            if len(parts) >= chunk_rows:
+                yield ''.join(parts)
+                parts = []
+        parts.append(']' if fmt == 'json' else '')
+        yield ''.join(parts)
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson' if fmt == 'ndjson' else 'application/json')
+
+
+PRODUCT_SORTS = {
+    'id': (Product.id, False, int),
+    'newest': (Product.created_at, True, datetime.fromisoformat),
+    'price_asc': (Product.price, False, float),
+    'price_desc': (Product.price, True, float),
+    'name': (Product.name, False, str),
+}
+
+
+@app.route('/get_products_page')
+@cache.cached('catalog')
+def get_products_page():
+    sort = request.args.get('sort', 'id')
+    if sort not in PRODUCT_SORTS:
+        return jsonify({'error': f'Unknown sort: {sort}'}), 400
+    column, descending, value_type = PRODUCT_SORTS[sort]
+    limit = page_limit()
+
+    query = product_catalog_query().order_by(None)
+
+    # Filters
+    keyword = request.args.get('q', '').strip()
+    if keyword:
+        pattern = f'%{keyword}%'
+        query = query.filter(or_(Product.name.ilike(pattern), ClothType.type_name.ilike(pattern)))
+    cloth_type_id = request.args.get('cloth_type_id', type=int)
+    if cloth_type_id is not None:
+        query = query.filter(Product.cloth_type_id == cloth_type_id)
+    color = request.args.get('color', '').strip()
+    if color:
+        query = query.filter(Product.color.ilike(color))
+    min_price = request.args.get('min_price', type=float)
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    max_price = request.args.get('max_price', type=float)
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    if request.args.get('in_stock') in ('1', 'true'):
+        query = query.filter(Product.total_stock > 0)
+
+    # Seek past the last row of the previous page
+    cursor = request.args.get('cursor')
+    if cursor:
+        decoded = decode_cursor(cursor, value_type, int)
+        if decoded is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        value, last_id = decoded
+        query = query.filter(keyset_after(column, value, Product.id, last_id, descending))
+
+    if descending:
+        query = query.order_by(column.desc(), Product.id.desc())
+    else:
+        query = query.order_by(column, Product.id)
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1][0]
+        next_cursor = encode_cursor(getattr(last, column.key), last.id)
+
+    return jsonify({
+        'products': [{
             'id': p.id,
             'name': p.name,
             'price': p.price,
+            'color': p.color,
             'image_url': p.image_url,
-            'cloth_type': cloth_type_name,
+            'image_variants': images.variant_urls(p.image_url),
+            'cloth_type': cloth_type_name or "N/A",
             'total_stock': total_stock
-        })
+        } for p, cloth_type_name, total_stock in rows],
+        'next_cursor': next_cursor
+    })
 
-    return jsonify(product_data)
+
+@app.route('/search')
+@cache.cached('catalog')
+def search_products():
+    keyword = request.args.get('q', '')
+    limit = page_limit(default=20)
+
+    product_ids = search.search_product_ids(keyword, limit)
+    if not product_ids:
+        return jsonify([])
+
+    rows = product_catalog_query().filter(Product.id.in_(product_ids)).all()
+    position = {product_id: i for i, product_id in enumerate(product_ids)}
+    rows.sort(key=lambda row: position[row[0].id])
+
+    return jsonify([{
+        'id': p.id,
+        'name': p.name,
+        'price': p.price,
+        'image_url': p.image_url,
+        'image_variants': images.variant_urls(p.image_url),
+        'cloth_type': cloth_type_name or "N/A",
+        'total_stock': total_stock
+    } for p, cloth_type_name, total_stock in rows])
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Re-index every product into the full-text search table."""
+    count = search.rebuild_search_index()
+    db.session.commit()
+    print(f'Indexed {count} products')
 
 
 # ---------------- Users ----------------
@@ -167,22 +447,32 @@ def create_user():
 
 @app.route('/get_users', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    return jsonify([{k: v for k, v in u.__dict__.items() if not k.startswith('_')} for u in users])
+    page = keyset_page(User.query, User.id, limit=page_limit(default=100, maximum=500))
+    if page is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    users, next_cursor = page
+    return jsonify({
+        'users': [{k: v for k, v in u.__dict__.items() if not k.startswith('_') and k != 'password'}
+                  for u in users],
+        'next_cursor': next_cursor
+    })
 
 
 @app.route('/product_details/<int:product_id>')
+@cache.conditional
+@cache.cached('product:{product_id}')
 def product_details(product_id):
-    # Get product
-    product = Product.query.filter_by(id=product_id).first()
-    if not product:
+    # Product and its cloth type in one query
+    row = db.session.query(Product, ClothType) \
+        .outerjoin(ClothType, ClothType.id == Product.cloth_type_id) \
+        .filter(Product.id == product_id).first()
+    if not row:
         return "Product not found", 404
-
-    # Get cloth type manually
-    cloth_type = ClothType.query.filter_by(id=product.cloth_type_id).first()
+    product, cloth_type = row
+    cache.tag(f'cloth_type:{product.cloth_type_id}')
 
     # Get available sizes for this product
-    sizes = ProductSize.query.filter_by(product_id=product.id).all()
+    sizes = ProductSize.query.filter_by(product_id=product.id).order_by(ProductSize.size_label).all()
 
     # Get reviews with usernames
     reviews = db.session.query(Review, User.username).join(User, Review.user_id == User.id) \
@@ -194,37 +484,50 @@ def product_details(product_id):
         'comment': review.comment
     } for review, username in reviews]
 
+    # Precomputed top-K list, one indexed lookup (see models/recommendations.py)
+    bought_together = [{
+        'id': p.id,
+        'name': p.name,
+        'price': p.price,
+        'image_url': p.image_url
+    } for p, score in recommendations.for_product(product.id)]
+
     return render_template(
         'user/product_details.html',
         product=product,
         cloth_type=cloth_type,
         sizes=sizes,
         reviews=formatted_reviews,
+        bought_together=bought_together,
+        image_variants=images.variant_urls(product.image_url),
         is_admin=(session.get('role') == 'admin')
     )
 
 
-@app.route('/get_product_sizes')
-def get_product_sizes():
+def product_size_rows():
     from models.product_size import ProductSize
     from models.product import Product
 
-    sizes = ProductSize.query.all()
-    response = []
+    rows = db.session.query(ProductSize.product_id, Product.name, ProductSize.size_label, ProductSize.stock) \
+        .outerjoin(Product, Product.id == ProductSize.product_id) \
+        .order_by(ProductSize.product_id, ProductSize.size_label).yield_per(1000)
+    for product_id, product_name, size_label, stock in rows:
+        yield {
+            'product_id': product_id,
+            'product_name': product_name or "Unknown",
+            'size_label': size_label,
+            'stock': stock
+        }
 
-    for size in sizes:
-        product = Product.query.filter_by(id=size.product_id).first()
-        response.append({
-            'product_id': size.product_id,
-            'product_name': product.name if product else "Unknown",
-            'size_label': size.size_label,
-            'stock': size.stock
-        })
 
-    return jsonify(response)
+@app.route('/get_product_sizes')
+def get_product_sizes():
+    # Every size row, so it is streamed rather than cached
+    return stream_json(product_size_rows(), 'ndjson' if request.args.get('format') == 'ndjson' else 'json')
 
 
 @app.route('/add_order', methods=['POST'])
+@idempotency.idempotent
 def add_order():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
@@ -238,45 +541,369 @@ def add_order():
     )
     db.session.add(new_order)
     db.session.commit()
+    metrics.inc('orders_placed', route='add_order')
 
     return jsonify({'order_id': new_order.id})
 
 
 @app.route('/add_order_items', methods=['POST'])
+@idempotency.idempotent
 def add_order_items():
     data = request.get_json()
     order_id = data['order_id']
     items = data['items']
+    inventory.release_expired_reservations()
 
+    # Get product prices in one query
+    product_ids = [item['product_id'] for item in items]
+    prices = dict(db.session.query(Product.id, Product.price).filter(Product.id.in_(product_ids)).all())
+    recommendations.record_order(order_id, [pid for pid in product_ids if pid in prices])
+
+    added = []
     for item in items:
-        # Get product price
-        product = Product.query.get(item['product_id'])
-        if not product:
+        if item['product_id'] not in prices:
+            db.session.rollback()
             return jsonify({'error': 'Product not found'}), 404
+        if int(item['quantity']) < 1:
+            db.session.rollback()
+            return jsonify({'error': 'Quantity must be at least 1'}), 400
+
+        # Update stock
+        if not inventory.take_stock(item['product_id'], item['size_label'], item['quantity']):
+            db.session.rollback()
+            metrics.inc('stock_failures', route='add_order_items')
+            return jsonify({'error': f'Not enough stock for {item["size_label"]}'}), 400
 
         # Insert order item with actual price
-        new_item = OrderItem(
+        added.append(OrderItem(
             order_id=order_id,
             product_id=item['product_id'],
             size_label=item['size_label'],
             quantity=item['quantity'],
-            price=product.price  # ✅ fixed here
-        )
-        db.session.add(new_item)
+            price=prices[item['product_id']]
+        ))
 
-        # Update stock
-        size_entry = ProductSize.query.filter_by(
-            product_id=item['product_id'],
-            size_label=item['size_label']
-        ).first()
+    db.session.add_all(added)
+    db.session.flush()
+    sales_rollups.record_items([order_item.id for order_item in added])
+    db.session.commit()
+    return jsonify({'success': True})
+
+
+def parse_cart_lines(items):
+    # Validate (product_id, size_label, quantity) lines and merge duplicates.
+    # Returns ({(product_id, size_label): quantity}, error message)
+    if not isinstance(items, list) or not items:
+        return None, 'Cart is empty'
+
+    lines = {}
+    for item in items:
+        try:
+            product_id = int(item['product_id'])
+            size_label = str(item['size_label'])
+            quantity = int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            return None, 'Each item needs product_id, size_label and quantity'
+        if quantity < 1:
+            return None, 'Quantity must be at least 1'
+        key = (product_id, size_label)
+        lines[key] = lines.get(key, 0) + quantity
+    return lines, None
+
+
+def stock_error(product_id, size_label):
+    product = Product.query.get(product_id)
+    if not product:
+        return jsonify({'error': f'Product {product_id} not found'}), 404
+    return jsonify({'error': f'Not enough stock for "{product.name}" ({size_label})'}), 400
+
+
+MAX_CART_LINES = 100
+
+
+@app.route('/cart/quote', methods=['POST'])
+def quote_cart():
+    """Current prices, stock and total for a cart, without placing an order."""
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list):
+        return jsonify({'error': 'items must be a list'}), 400
+    if len(items) > MAX_CART_LINES:
+        return jsonify({'error': f'A cart can hold at most {MAX_CART_LINES} lines'}), 400
 
-        if size_entry and size_entry.stock >= item['quantity']:
-            size_entry.stock -= item['quantity']
+    lines = []
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        try:
+            product_id = int(item.get('product_id'))
+        except (TypeError, ValueError):
+            product_id = None
+        try:
+            quantity = int(item.get('quantity'))
+        except (TypeError, ValueError):
+            quantity = 0
+        size_label = item.get('size_label')
+        lines.append((product_id, str(size_label) if size_label not in (None, '') else None, quantity))
+
+    # Abandoned cart holds must not show as sold out
+    if inventory.release_expired_reservations():
+        db.session.commit()
+
+    # Every product and requested size in one query: sizes are outer-joined,
+    # so a product row comes back even when none of its sizes match
+    product_ids = {product_id for product_id, _, _ in lines if product_id is not None}
+    sizes = {(product_id, size_label) for product_id, size_label, _ in lines
+             if product_id is not None and size_label is not None}
+    rows = db.session.query(Product.id, Product.name, Product.price, Product.image_url,
+                            ProductSize.size_label, ProductSize.stock) \
+        .outerjoin(ProductSize, and_(ProductSize.product_id == Product.id,
+                                     tuple_(ProductSize.product_id, ProductSize.size_label).in_(list(sizes)))) \
+        .filter(Product.id.in_(product_ids)).all()
+
+    products = {}
+    stock = {}
+    for product_id, name, price, image_url, size_label, size_stock in rows:
+        products[product_id] = {'name': name, 'price': price, 'image_url': image_url}
+        if size_label is not None:
+            stock[(product_id, size_label)] = size_stock
+
+    quoted = []
+    total = 0
+    for product_id, size_label, quantity in lines:
+        product = products.get(product_id)
+        available = stock.get((product_id, size_label))
+        if product is None:
+            error = 'Product no longer available'
+        elif size_label is None:
+            error = 'Choose a size'
+        elif available is None:
+            error = f'Size {size_label} is not offered'
+        elif quantity < 1:
+            error = 'Quantity must be at least 1'
+        elif quantity > available:
+            error = f'Only {available} left in size {size_label}' if available else f'Size {size_label} is sold out'
         else:
-            return jsonify({'error': f'Not enough stock for {item["size_label"]}'}), 400
+            error = None
+        # Lines that cannot be bought have no total, so the line totals add up to ``total``
+        line_total = round(product['price'] * quantity, 2) if error is None else None
+        total += line_total or 0
+        quoted.append({
+            'product_id': product_id,
+            'size_label': size_label,
+            'quantity': quantity,
+            'name': product['name'] if product else None,
+            'image_url': product['image_url'] if product else None,
+            'unit_price': product['price'] if product else None,
+            'line_total': line_total,
+            'available': available or 0,
+            'error': error
+        })
+
+    return jsonify({
+        'lines': quoted,
+        'total': round(total, 2),
+        'can_checkout': bool(quoted) and all(line['error'] is None for line in quoted)
+    })
+
+
+@app.route('/checkout', methods=['POST'])
+@idempotency.idempotent
+def checkout():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    token = data.get('reservation')
+
+    # Stock is taken before anything is read, so the transaction starts as a
+    # writer and cannot fail to upgrade its lock halfway through
+    if token:
+        lines = inventory.confirm_reservation(token, session['user_id'])
+        if not lines:
+            db.session.rollback()
+            return jsonify({'error': 'Reservation has expired'}), 409
+    else:
+        lines, error = parse_cart_lines(data.get('items'))
+        if error:
+            return jsonify({'error': error}), 400
+        failed = inventory.take_lines(lines)
+        if failed:
+            db.session.rollback()
+            metrics.inc('stock_failures', route='checkout')
+            return stock_error(*failed)
+
+    # Price every line with one query
+    product_ids = {product_id for product_id, _ in lines}
+    prices = dict(db.session.query(Product.id, Product.price).filter(Product.id.in_(product_ids)).all())
+
+    total_amount = sum(prices[product_id] * quantity for (product_id, _), quantity in lines.items())
+    order = Order(
+        user_id=session['user_id'],
+        order_date=datetime.now(),
+        total_amount=total_amount,
+        status='Pending'
+    )
+    db.session.add(order)
+    db.session.flush()
+
+    recommendations.record_order(order.id, product_ids)
+    order_items = [OrderItem(
+        order_id=order.id,
+        product_id=product_id,
+        size_label=size_label,
+        quantity=quantity,
+        price=prices[product_id]
+    ) for (product_id, size_label), quantity in lines.items()]
+    db.session.add_all(order_items)
+    db.session.flush()
+    sales_rollups.record_items([order_item.id for order_item in order_items])
 
     db.session.commit()
-    return jsonify({'success': True})
+    metrics.inc('orders_placed', route='checkout')
+    return jsonify({'order_id': order.id, 'total_amount': total_amount})
+
+
+@app.route('/reserve_cart', methods=['POST'])
+def reserve_cart():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    lines, error = parse_cart_lines(data.get('items'))
+    if error:
+        return jsonify({'error': error}), 400
+
+    token, result = inventory.reserve_lines(lines, session['user_id'])
+    if not token:
+        db.session.rollback()
+        metrics.inc('stock_failures', route='reserve_cart')
+        return stock_error(*result)
+
+    db.session.commit()
+    return jsonify({'reservation': token, 'expires_at': result.strftime('%Y-%m-%d %H:%M:%S')})
+
+
+@app.route('/release_reservation', methods=['POST'])
+def release_reservation():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    released = inventory.release_reservation(data.get('reservation'), session['user_id'])
+    db.session.commit()
+    return jsonify({'released': released})
+
+
+@app.cli.command('adopt-legacy-images')
+def adopt_legacy_images_command():
+    """Give pre-pipeline product images content-addressed names and variants."""
+    updated = 0
+    for product in Product.query.filter(Product.image_url != '').all():
+        image_url = images.adopt_legacy_image(product.image_url)
+        if image_url != product.image_url:
+            product.image_url = image_url
+            updated += 1
+    cache.invalidate('catalog')
+    db.session.commit()
+    print(f'Updated {updated} product images')
+
+
+@app.cli.command('check-aggregates')
+@click.option('--fix', is_flag=True, help='Overwrite drifted values with a fresh recount.')
+def check_aggregates_command(fix):
+    """Compare stored product stock/review totals with a recount."""
+    drift = aggregates.find_drift()
+    for product_id, stock, actual_stock, count, actual_count, rating, actual_rating in drift:
+        print(f'product {product_id}: total_stock {stock} != {actual_stock}, '
+              f'review_count {count} != {actual_count}, rating_sum {rating} != {actual_rating}')
+    print(f'{len(drift)} products drifted')
+
+    if drift and fix:
+        aggregates.recompute_all()
+        db.session.commit()
+        print('Aggregates recomputed')
+
+
+CATALOG_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def catalog_format(filename, fmt=None):
+    # Explicit format, else the file extension (.csv, .jsonl / .ndjson)
+    if not fmt:
+        fmt = os.path.splitext(filename or '')[1].lstrip('.').lower()
+    return 'jsonl' if fmt == 'ndjson' else fmt
+
+
+@app.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(list(CATALOG_FORMATS)), help='Default: from the file extension.')
+@click.option('--batch-size', default=catalog_io.BATCH_SIZE, show_default=True, help='Rows per transaction.')
+def import_catalog_command(path, fmt, batch_size):
+    """Create or update products, sizes and cloth types from a CSV/JSONL file."""
+    fmt = catalog_format(path, fmt)
+    if fmt not in CATALOG_FORMATS:
+        raise click.UsageError('Pass --format csv or --format jsonl')
+    with open(path, 'rb') as stream:
+        result = catalog_io.import_catalog(stream, fmt, batch_size=batch_size)
+    for error in result['errors']:
+        print(f"line {error['line']}: {error['error']}")
+    print(f"{result['created']} created, {result['upserted']} upserted, {result['error_count']} rows with errors")
+
+
+@app.cli.command('export-catalog')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(list(CATALOG_FORMATS)), help='Default: from the file extension.')
+def export_catalog_command(path, fmt):
+    """Write every product with its sizes to a CSV/JSONL file."""
+    fmt = catalog_format(path, fmt)
+    if fmt not in CATALOG_FORMATS:
+        raise click.UsageError('Pass --format csv or --format jsonl')
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        for chunk in catalog_io.export_catalog(fmt):
+            out.write(chunk)
+    print(f'Exported the catalog to {path}')
+
+
+@app.cli.command('release-expired-reservations')
+def release_expired_reservations_command():
+    """Return the stock held by expired cart reservations."""
+    released = inventory.release_expired_reservations()
+    db.session.commit()
+    print(f'Released {released} reservation lines')
+
+
+@app.cli.command('rebuild-recommendations')
+def rebuild_recommendations_command():
+    """Recompute 'frequently bought together' from all order history."""
+    pairs = recommendations.rebuild_recommendations()
+    db.session.commit()
+    print(f'Counted {pairs} co-purchased product pairs')
+
+
+@app.cli.command('backfill-sales-rollups')
+@click.option('--batch-size', default=sales_rollups.BATCH_SIZE, show_default=True, help='Orders per transaction.')
+def backfill_sales_rollups_command(batch_size):
+    """Rebuild the daily sales rollups from order history."""
+    batches = sales_rollups.backfill(batch_size, progress=lambda done, last: print(f'orders up to #{done} of #{last}'))
+    print(f'Rolled up sales in {batches} batches')
+
+
+@app.cli.command('archive-orders')
+@click.option('--days', type=int, help='Minimum age in days. Default: ARCHIVE_AFTER_DAYS (180).')
+@click.option('--batch-size', default=archive.BATCH_SIZE, show_default=True, help='Orders per transaction.')
+def archive_orders_command(days, batch_size):
+    """Move old Delivered/Cancelled orders into the archive database."""
+    moved = archive.archive_orders(days, batch_size, progress=lambda moved: print(f'{moved} orders archived'))
+    print(f'Archived {moved} orders')
+
+
+@app.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """Delete idempotency keys older than IDEMPOTENCY_KEY_TTL."""
+    from models.idempotency_key import purge_expired_keys
+    purged = purge_expired_keys(app.config['IDEMPOTENCY_KEY_TTL'])
+    db.session.commit()
+    print(f'Purged {purged} idempotency keys')
 
 
 @app.route('/cart')
@@ -296,9 +923,14 @@ def orders():
 @app.route('/get_orders')
 def get_orders():
     if 'user_id' not in session:
-        return jsonify([])
+        return jsonify({'orders': [], 'next_cursor': None})
 
-    orders = Order.query.filter_by(user_id=session['user_id']).order_by(Order.order_date.desc()).all()
+    # Newest first; older pages continue into archived orders
+    page = orders_page(lambda model: model.query.filter(model.user_id == session['user_id']),
+                       page_limit(default=20, maximum=100))
+    if page is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    orders, next_cursor = page
 
     data = [{
         'id': o.id,
@@ -307,7 +939,7 @@ def get_orders():
         'total_amount': o.total_amount
     } for o in orders]
 
-    return jsonify(data)
+    return jsonify({'orders': data, 'next_cursor': next_cursor})
 
 
 @app.route('/get_order_details/<int:order_id>')
@@ -319,24 +951,31 @@ def get_order_details(order_id):
     if 'user_id' not in session:
         return redirect('/login')
 
-    order = Order.query.get_or_404(order_id)
+    # Old orders may have been moved to the archive database
+    item_model = OrderItem
+    order = Order.query.get(order_id)
+    if order is None:
+        order = archive.ArchivedOrder.query.get_or_404(order_id)
+        item_model = archive.ArchivedOrderItem
 
     if session['role'] == 'customer' and order.user_id != session['user_id']:
         return "Unauthorized", 403
 
-    order_items = OrderItem.query.filter_by(order_id=order.id).all()
-    item_details = []
-
-    for item in order_items:
-        product = Product.query.get(item.product_id)
-        item_details.append({
-            'product_id': product.id,
-            'name': product.name,
-            'image_url': product.image_url,
-            'quantity': item.quantity,
-            'price': item.price,
-            'size_label': item.size_label
-        })
+    # Lines with their products in one query; product_id is nulled when
+    # the product has since been deleted, hence the outer join
+    order_items = db.session.query(item_model, Product.name, Product.image_url) \
+        .outerjoin(Product, Product.id == item_model.product_id) \
+        .filter(item_model.order_id == order.id) \
+        .order_by(item_model.id).all()
+
+    item_details = [{
+        'product_id': item.product_id,
+        'name': name or 'Product no longer available',
+        'image_url': image_url or '',
+        'quantity': item.quantity,
+        'price': item.price,
+        'size_label': item.size_label
+    } for item, name, image_url in order_items]
 
     return render_template(
         'user/order_details.html',
@@ -345,73 +984,74 @@ def get_order_details(order_id):
     )
 
 
-@app.route('/cancel_order', methods=['POST'])
-def cancel_order():
-    from models.order import Order
-    from models.order_item import OrderItem
-    from models.product_size import ProductSize
+def cancel_pending_order(order_id, user_id=None):
+    # Pending -> Cancelled and the stock restore commit together. The status
+    # check is part of the UPDATE, so a double submit restores stock once.
+    statement = update(Order).where(Order.id == order_id, func.lower(func.trim(Order.status)) == 'pending')
+    if user_id is not None:
+        statement = statement.where(Order.user_id == user_id)
 
-    if 'user_id' not in session or session.get('role') != 'customer':
-        return redirect('/login')
+    result = db.session.execute(statement.values(status='Cancelled'))
+    if result.rowcount != 1:
+        db.session.rollback()
+        return False
 
-    order_id = request.form.get('order_id')
-    order = Order.query.filter_by(id=order_id, user_id=session['user_id']).first()
+    inventory.restore_order_stock(order_id)
+    sales_rollups.record_transition(order_id, 'Pending', 'Cancelled')
+    db.session.commit()
+    metrics.inc('orders_cancelled', by='admin' if user_id is None else 'customer')
+    return True
 
-    if order and order.status.lower().strip() == 'pending':
-        order.status = 'Cancelled'
 
-        # restore stock
-        items = OrderItem.query.filter_by(order_id=order.id).all()
-        for item in items:
-            size = ProductSize.query.filter_by(product_id=item.product_id, size_label=item.size_label).first()
-            if size:
-                size.stock += item.quantity
+def deliver_order(order_id, from_status='Pending'):
+    # Same guarded UPDATE as cancelling: it only applies while the order is
+    # still in ``from_status``, so a double submit is counted once
+    result = db.session.execute(
+        update(Order).where(Order.id == order_id,
+                            func.lower(func.trim(Order.status)) == from_status.strip().lower())
+        .values(status='Delivered')
+    )
+    if result.rowcount != 1:
+        db.session.rollback()
+        return False
 
-        db.session.commit()
+    sales_rollups.record_transition(order_id, from_status, 'Delivered')
+    db.session.commit()
+    return True
+
+
+@app.route('/cancel_order', methods=['POST'])
+def cancel_order():
+    if 'user_id' not in session or session.get('role') != 'customer':
+        return redirect('/login')
+
+    order_id = request.form.get('order_id', type=int)
+    if order_id:
+        cancel_pending_order(order_id, user_id=session['user_id'])
 
     return redirect(f'/get_order_details/{order_id}')
 
 
 @app.route('/admin/cancel_order', methods=['POST'])
 def admin_cancel_order():
-    from models.order import Order
-    from models.order_item import OrderItem
-    from models.product_size import ProductSize
-
     if session.get('role') != 'admin':
         return redirect('/login')
 
-    order_id = request.form.get('order_id')
-    order = Order.query.get(order_id)
-
-    if order and order.status == 'Pending':
-        order.status = 'Cancelled'
-
-        # Restore stock
-        order_items = OrderItem.query.filter_by(order_id=order.id).all()
-        for item in order_items:
-            size = ProductSize.query.filter_by(product_id=item.product_id, size_label=item.size_label).first()
-            if size:
-                size.stock += item.quantity
-
-        db.session.commit()
+    order_id = request.form.get('order_id', type=int)
+    if order_id:
+        cancel_pending_order(order_id)
 
     return redirect(f'/get_order_details/{order_id}')
 
 
 @app.route('/admin/mark_delivered', methods=['POST'])
 def admin_mark_delivered():
-    from models.order import Order
-
     if session.get('role') != 'admin':
         return redirect('/login')
 
-    order_id = request.form.get('order_id')
-    order = Order.query.get(order_id)
-
-    if order and order.status == 'Pending':
-        order.status = 'Delivered'
-        db.session.commit()
+    order_id = request.form.get('order_id', type=int)
+    if order_id:
+        deliver_order(order_id)
 
     return redirect(f'/get_order_details/{order_id}')
 
@@ -435,6 +1075,8 @@ def delete_product():
     product = Product.query.get(product_id)
     if product:
         db.session.delete(product)
+        search.remove_product(product.id)
+        cache.invalidate('catalog', f'product:{product.id}')
 
     db.session.commit()
     return redirect('/admin/products')
@@ -442,8 +1084,6 @@ def delete_product():
 
 @app.route('/admin/update_stock', methods=['POST'])
 def update_stock():
-    from models.product_size import ProductSize
-
     if 'user_id' not in session or session.get('role') != 'admin':
         return redirect('/login')
 
@@ -457,18 +1097,8 @@ def update_stock():
         if stock_field in request.form:
             stock_value = int(request.form[stock_field])
 
-            size_entry = ProductSize.query.filter_by(product_id=product_id, size_label=size_label).first()
-
-            if size_entry:
-                size_entry.stock = stock_value
-            else:
-                # Create size entry if it doesn't exist
-                new_size = ProductSize(
-                    product_id=product_id,
-                    size_label=size_label,
-                    stock=stock_value
-                )
-                db.session.add(new_size)
+            # Creates the size entry if it doesn't exist
+            inventory.set_stock(int(product_id), size_label, stock_value)
 
     db.session.commit()
     return redirect(f'/product_details/{product_id}')
@@ -476,13 +1106,15 @@ def update_stock():
 
 @app.route('/admin/users')
 def admin_users():
-    from models.user import User
-
     if 'user_id' not in session or session.get('role') != 'admin':
         return redirect('/login')
 
-    users = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin/users.html', users=users)
+    page = admin_users_page()
+    if page is None:
+        return redirect(url_for('admin_users'))
+    users, next_cursor = page
+    return render_template('admin/users.html', users=users, filters=request.args,
+                           next_url=page_url('admin_users', next_cursor))
 
 
 @app.route('/admin/delete_user', methods=['POST'])
@@ -496,6 +1128,7 @@ def admin_delete_user():
     user = User.query.get(user_id)
 
     if user:
+        aggregates.forget_user_reviews(user.id)
         db.session.delete(user)
         db.session.commit()
 
@@ -504,13 +1137,15 @@ def admin_delete_user():
 
 @app.route('/admin/orders')
 def admin_orders():
-    from models.order import Order
-
     if 'user_id' not in session or session.get('role') != 'admin':
         return redirect('/login')
 
-    orders = Order.query.order_by(Order.order_date.desc()).all()
-    return render_template('admin/orders.html', orders=orders)
+    page = admin_orders_page()
+    if page is None:
+        return redirect(url_for('admin_orders'))
+    orders, next_cursor = page
+    return render_template('admin/orders.html', orders=orders, filters=request.args,
+                           next_url=page_url('admin_orders', next_cursor))
 
 
 @app.route('/admin/cloth_types', methods=['GET', 'POST'])
@@ -536,6 +1171,7 @@ def admin_cloth_types():
             else:
                 new_type = ClothType(type_name=type_name.strip(), description=description.strip())
                 db.session.add(new_type)
+                cache.invalidate('cloth_types')
                 db.session.commit()
                 return redirect('/admin/cloth_types')
 
@@ -554,7 +1190,9 @@ def delete_cloth_type():
     cloth_type = ClothType.query.get(cloth_type_id)
 
     if cloth_type:
+        search.reindex_cloth_type(cloth_type.id, '')
         db.session.delete(cloth_type)
+        cache.invalidate('cloth_types', 'catalog', f'cloth_type:{cloth_type.id}')
         db.session.commit()
 
     return redirect('/admin/cloth_types')
@@ -573,6 +1211,7 @@ def add_cloth_type():
     )
     try:
         db.session.add(cloth_type)
+        cache.invalidate('cloth_types')
         db.session.commit()
         db.session.close()
     except Exception as e:
@@ -582,9 +1221,17 @@ def add_cloth_type():
 
 
 @app.route('/get_cloth_types', methods=['GET'])
+@cache.conditional
+@cache.cached('cloth_types')
 def get_cloth_types():
-    types = ClothType.query.all()
-    return jsonify([{k: v for k, v in t.__dict__.items() if not k.startswith('_')} for t in types])
+    page = keyset_page(ClothType.query, ClothType.id, limit=page_limit(default=100, maximum=500))
+    if page is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    types, next_cursor = page
+    return jsonify({
+        'cloth_types': [{k: v for k, v in t.__dict__.items() if not k.startswith('_')} for t in types],
+        'next_cursor': next_cursor
+    })
 
 
 # # ---------------- Products ----------------
@@ -638,13 +1285,8 @@ def add_product_size():
     size_label = request.form.get('size_label')
     stock = request.form.get('stock')
 
-    size = ProductSize(
-        product_id=product_id,
-        size_label=size_label,
-        stock=stock
-    )
     try:
-        db.session.add(size)
+        inventory.set_stock(int(product_id), size_label, int(stock))
         db.session.commit()
         db.session.close()
     except Exception as e:
@@ -662,7 +1304,7 @@ def submit_review():
         return redirect('/login')
 
     user_id = session['user_id']
-    product_id = request.form.get('product_id')
+    product_id = int(request.form.get('product_id'))
     rating = int(request.form.get('rating'))
     comment = request.form.get('comment')
 
@@ -674,6 +1316,7 @@ def submit_review():
         review_date=datetime.now()
     )
     db.session.add(new_review)
+    aggregates.record_review(product_id, rating)
     db.session.commit()
 
     return redirect(request.referrer or '/orders')
@@ -689,8 +1332,8 @@ def set_order_delivered():
     if not order:
         return jsonify({'error': 'Order not found'}), 404
 
-    order.status = 'Delivered'
-    db.session.commit()
+    if order.status.strip().lower() != 'delivered' and not deliver_order(order.id, order.status):
+        return jsonify({'error': f'Order #{order.id} was changed by another request, try again'}), 409
     return jsonify({'message': f'Order #{order.id} marked as Delivered'})
 
 
@@ -709,28 +1352,166 @@ def admin_dashboard():
 
 @app.route('/admin/get_orders')
 def admin_get_orders():
-    from models.order import Order
     if session.get('role') != 'admin':
-        return jsonify([])
+        return jsonify({'error': 'Unauthorized'}), 401
 
-    orders = Order.query.order_by(Order.order_date.desc()).all()
-    return jsonify([{
-        'id': o.id,
-        'total_amount': o.total_amount
-    } for o in orders])
+    page = admin_orders_page()
+    if page is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    orders, next_cursor = page
+    return jsonify({
+        'orders': [{
+            'id': o.id,
+            'user_id': o.user_id,
+            'order_date': o.order_date.isoformat() if o.order_date else None,
+            'status': o.status,
+            'total_amount': o.total_amount
+        } for o in orders],
+        'next_cursor': next_cursor
+    })
+
+
+@app.route('/admin/cache_stats')
+def admin_cache_stats():
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(cache.stats())
+
+
+@app.route('/admin/sql_stats', methods=['GET', 'DELETE'])
+def admin_sql_stats():
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    if request.method == 'DELETE':
+        instrumentation.reset()
+        return jsonify({'message': 'SQL stats reset'})
+
+    # Heaviest endpoints first
+    endpoints = instrumentation.stats()
+    return jsonify(dict(sorted(endpoints.items(), key=lambda item: -item[1]['db_time_ms'])))
+
+
+@app.route('/admin/stats')
+@cache.cached('admin_stats', ttl=30)
+def admin_stats():
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    days = min(request.args.get('days', default=30, type=int), 366)
+    weeks = min(request.args.get('weeks', default=12, type=int), 104)
+    return jsonify(stats.dashboard_stats(days=days, weeks=weeks))
+
+
+@app.route('/admin/sales_report')
+def admin_sales_report():
+    # ?from=&to= (YYYY-MM-DD, default the last 30 days), ?group_by=day|product|cloth_type|size,
+    # optional ?product_id= / ?cloth_type_id= filters. Read from the daily rollups only.
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    group_by = request.args.get('group_by', 'day')
+    if group_by not in sales_rollups.GROUPINGS:
+        return jsonify({'error': f"group_by must be one of {', '.join(sales_rollups.GROUPINGS)}"}), 400
+    try:
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') \
+            else datetime.now().date()
+        date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') \
+            else date_to - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+
+    rows = sales_rollups.sales_report(
+        date_from, date_to, group_by,
+        product_id=request.args.get('product_id', type=int),
+        cloth_type_id=request.args.get('cloth_type_id', type=int)
+    )
+    return jsonify({'from': date_from.isoformat(), 'to': date_to.isoformat(), 'group_by': group_by, 'rows': rows})
 
 
 @app.route('/admin/get_users')
 def admin_get_users():
-    from models.user import User
     if session.get('role') != 'admin':
-        return jsonify([])
+        return jsonify({'error': 'Unauthorized'}), 401
 
-    users = User.query.all()
-    return jsonify([{
-        'id': u.id,
-        'role': u.role
-    } for u in users])
+    page = admin_users_page()
+    if page is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    users, next_cursor = page
+    return jsonify({
+        'users': [{
+            'id': u.id,
+            'username': u.username,
+            'email': u.email,
+            'role': u.role,
+            'created_at': u.created_at.isoformat() if u.created_at else None
+        } for u in users],
+        'next_cursor': next_cursor
+    })
+
+
+@app.route('/admin/import_catalog', methods=['POST'])
+def admin_import_catalog():
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+    fmt = catalog_format(upload.filename, request.form.get('format'))
+    if fmt not in CATALOG_FORMATS:
+        return jsonify({'error': 'Upload a .csv or .jsonl file, or pass format'}), 400
+
+    return jsonify(catalog_io.import_catalog(upload.stream, fmt, created_by=session['user_id']))
+
+
+@app.route('/admin/export_catalog')
+def admin_export_catalog():
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in CATALOG_FORMATS:
+        return jsonify({'error': f'Unknown format: {fmt}'}), 400
+    return Response(
+        stream_with_context(catalog_io.export_catalog(fmt)),
+        mimetype=CATALOG_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename=catalog.{fmt}'}
+    )
+
+
+def export_rows(dataset):
+    # Column tuples rather than ORM objects, read 1000 at a time
+    from models.order import Order
+
+    if dataset == 'users':
+        columns = [User.id, User.username, User.email, User.role, User.created_at]
+        query = filtered_users().with_entities(*columns).order_by(User.id)
+    elif dataset == 'orders':
+        columns = [Order.id, Order.user_id, Order.order_date, Order.status, Order.total_amount]
+        query = filtered_orders().with_entities(*columns).order_by(Order.id)
+    elif dataset == 'reviews':
+        columns = [Review.id, Review.user_id, Review.product_id, Review.rating, Review.comment, Review.review_date]
+        query = Review.query.with_entities(*columns).order_by(Review.id)
+    else:
+        return None
+    keys = [column.key for column in columns]
+    return (dict(zip(keys, row)) for row in query.yield_per(1000))
+
+
+@app.route('/admin/export/<dataset>')
+def admin_export(dataset):
+    """Whole-table exports of users, orders (same filters as /admin/orders) or reviews."""
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('json', 'ndjson'):
+        return jsonify({'error': f'Unknown format: {fmt}'}), 400
+    rows = export_rows(dataset)
+    if rows is None:
+        return jsonify({'error': f'Unknown dataset: {dataset}'}), 404
+    response = stream_json(rows, fmt)
+    response.headers['Content-Disposition'] = f'attachment; filename={dataset}.{fmt}'
+    return response
 
 
 @app.route('/admin/products')
@@ -738,39 +1519,25 @@ def admin_products():
     if 'user_id' not in session or session.get('role') != 'admin':
         return redirect('/login')
 
-    from models.product import Product
-    from models.product_size import ProductSize
-    from models.cloth_type import ClothType
-
-    products = Product.query.all()
-    result = []
-
-    for p in products:
-        cloth_type = ClothType.query.filter_by(id=p.cloth_type_id).first()
-        stock = db.session.query(db.func.sum(ProductSize.stock)) \
-                    .filter_by(product_id=p.id).scalar() or 0
-
-        result.append({
-            'id': p.id,
-            'name': p.name,
-            'image_url': p.image_url,
-            'price': p.price,
-            'cloth_type': cloth_type.type_name if cloth_type else "Unknown",
-            'total_stock': stock
-        })
+    result = [{
+        'id': p.id,
+        'name': p.name,
+        'image_url': p.image_url,
+        'price': p.price,
+        'cloth_type': cloth_type_name or "Unknown",
+        'total_stock': total_stock
+    } for p, cloth_type_name, total_stock in product_catalog_query().all()]
 
     return render_template('admin/products.html', products=result)
 
 
 import os
-from werkzeug.utils import secure_filename
 from datetime import datetime
 
 
 @app.route('/admin/add_product', methods=['GET', 'POST'])
 def add_product():
     from models.product import Product
-    from models.product_size import ProductSize
     from models.cloth_type import ClothType
 
     if 'user_id' not in session or session.get('role') != 'admin':
@@ -783,14 +1550,20 @@ def add_product():
         price = float(request.form['price'])
         cloth_type_id = int(request.form['cloth_type_id'])
 
+        # Check every size before anything is stored
+        sizes = {}
+        for size_label in ['S', 'M', 'L', 'XL']:
+            value = request.form.get(f'size_{size_label}', '').strip() or '0'
+            if not value.isdigit():
+                return jsonify({'error': f'Stock for {size_label} must be a whole number of 0 or more'}), 400
+            sizes[size_label] = int(value)
+
         # Handle image upload
         image_file = request.files.get('image')
         image_url = ''
         if image_file and image_file.filename:
-            filename = secure_filename(image_file.filename)
-            image_path = os.path.join('uploads', filename)
-            image_file.save(image_path)
-            image_url = image_path
+            # Stored under its content hash; thumbnails follow in the background
+            image_url = images.store_upload(image_file)
 
         # Insert product
         new_product = Product(
@@ -804,17 +1577,17 @@ def add_product():
             created_at=datetime.now()
         )
         db.session.add(new_product)
-        db.session.commit()
+        db.session.flush()
 
         # Add size-based stock
-        for size_label in ['S', 'M', 'L', 'XL']:
-            stock = int(request.form.get(f'size_{size_label}', 0))
+        for size_label, stock in sizes.items():
             if stock > 0:
-                db.session.add(ProductSize(
-                    product_id=new_product.id,
-                    size_label=size_label,
-                    stock=stock
-                ))
+                inventory.set_stock(new_product.id, size_label, stock)
+
+        # Product, sizes and search entry commit together
+        cloth_type = ClothType.query.get(cloth_type_id)
+        search.index_product(new_product, cloth_type.type_name if cloth_type else '')
+        cache.invalidate('catalog')
 
         db.session.commit()
         return redirect('/admin/products')
@@ -863,6 +1636,7 @@ def add_review():
     )
     try:
         db.session.add(review)
+        aggregates.record_review(int(product_id), int(rating) if rating else None)
         db.session.commit()
         db.session.close()
     except Exception as e:
@@ -873,8 +1647,18 @@ def add_review():
 
 @app.route('/get_reviews', methods=['GET'])
 def get_reviews():
-    reviews = Review.query.all()
-    return jsonify([{k: v for k, v in r.__dict__.items() if not k.startswith('_')} for r in reviews])
+    query = Review.query
+    product_id = request.args.get('product_id', type=int)
+    if product_id is not None:
+        query = query.filter(Review.product_id == product_id)
+    page = keyset_page(query, Review.id, limit=page_limit(default=100, maximum=500))
+    if page is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    reviews, next_cursor = page
+    return jsonify({
+        'reviews': [{k: v for k, v in r.__dict__.items() if not k.startswith('_')} for r in reviews],
+        'next_cursor': next_cursor
+    })
 
 
 if __name__ == '__main__':
@@ -0,0 +1,167 @@
+"""Oversell stress test for models.inventory.
+
+Threads in several processes race to buy the same sizes of one product on a
+scratch SQLite database in WAL mode, the way gunicorn workers would. The
+run fails if more units are sold than were stocked, if stock and order
+lines disagree afterwards, or if throughput is below --target-rate.
+
+    python benchmarks/inventory_stress.py --processes 4 --threads 8 --stock 200
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+SIZES = ['S', 'M', 'L', 'XL']
+
+
+def make_app(instance_path):
+    from models import init_app
+    app = Flask(__name__, instance_path=instance_path)
+    init_app(app)
+    return app
+
+
+def seed(instance_path, stock):
+    from models import db, inventory
+    from models.cloth_type import ClothType
+    from models.product import Product
+    from models.user import User
+
+    app = make_app(instance_path)
+    with app.app_context():
+        user = User(username='stress', email='stress@example.com', password='x', role='customer')
+        cloth_type = ClothType(type_name='Stress')
+        db.session.add_all([user, cloth_type])
+        db.session.flush()
+        product = Product(name='Stress tee', price=10.0, cloth_type_id=cloth_type.id, created_by=user.id)
+        db.session.add(product)
+        db.session.flush()
+        for size_label in SIZES:
+            inventory.set_stock(product.id, size_label, stock)
+        db.session.commit()
+        return user.id, product.id
+
+
+def buy(app, user_id, product_id, attempts, counts, lock):
+    from models import db, inventory
+    from models.order import Order
+    from models.order_item import OrderItem
+
+    sold = rejected = retries = 0
+    with app.app_context():
+        for i in range(attempts):
+            size_label = SIZES[i % len(SIZES)]
+            while True:
+                try:
+                    # Same shape as /checkout: take stock, then write the order
+                    if inventory.take_lines({(product_id, size_label): 1}):
+                        db.session.rollback()
+                        rejected += 1
+                        break
+                    order = Order(user_id=user_id, order_date=datetime.now(), total_amount=10.0, status='Pending')
+                    db.session.add(order)
+                    db.session.flush()
+                    db.session.add(OrderItem(order_id=order.id, product_id=product_id,
+                                             size_label=size_label, quantity=1, price=10.0))
+                    db.session.commit()
+                    sold += 1
+                    break
+                except OperationalError:
+                    # database is locked: the transaction was not applied
+                    db.session.rollback()
+                    retries += 1
+        db.session.remove()
+
+    with lock:
+        counts['sold'] += sold
+        counts['rejected'] += rejected
+        counts['retries'] += retries
+
+
+def run_process(instance_path, user_id, product_id, threads, attempts):
+    app = make_app(instance_path)
+    counts = {'sold': 0, 'rejected': 0, 'retries': 0}
+    lock = threading.Lock()
+    workers = [
+        threading.Thread(target=buy, args=(app, user_id, product_id, attempts, counts, lock))
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help='threads per process')
+    parser.add_argument('--stock', type=int, default=200, help='starting stock per size')
+    parser.add_argument('--attempts', type=int, default=None,
+                        help='checkouts per thread (default: enough to sell out twice over)')
+    parser.add_argument('--target-rate', type=float, default=0.0,
+                        help='minimum checkouts/s (sold + rejected) for the run to pass')
+    args = parser.parse_args()
+
+    workers = args.processes * args.threads
+    attempts = args.attempts or max(1, (2 * args.stock * len(SIZES)) // workers)
+
+    with tempfile.TemporaryDirectory() as instance_path:
+        user_id, product_id = seed(instance_path, args.stock)
+        database = os.path.join(instance_path, 'clothing_store.sqlite')
+        with sqlite3.connect(database) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(
+                run_process,
+                [(instance_path, user_id, product_id, args.threads, attempts)] * args.processes
+            )
+        elapsed = time.perf_counter() - started
+
+        sold = sum(r['sold'] for r in results)
+        rejected = sum(r['rejected'] for r in results)
+        retries = sum(r['retries'] for r in results)
+
+        with sqlite3.connect(database) as conn:
+            remaining = conn.execute('SELECT sum(stock), min(stock) FROM product_size').fetchone()
+            ordered = conn.execute('SELECT coalesce(sum(quantity), 0) FROM order_item').fetchone()[0]
+
+    initial = args.stock * len(SIZES)
+    rate = (sold + rejected) / elapsed
+    print(f'{workers} workers, {attempts} checkouts each, {elapsed:.2f}s')
+    print(f'sold={sold} rejected={rejected} lock_retries={retries} rate={rate:.0f} checkouts/s')
+    print(f'stock: initial={initial} remaining={remaining[0]} lowest size={remaining[1]} ordered={ordered}')
+
+    problems = []
+    if remaining[1] < 0:
+        problems.append('stock went negative')
+    if sold > initial:
+        problems.append(f'oversold by {sold - initial}')
+    if remaining[0] + sold != initial or ordered != sold:
+        problems.append('stock, sales and order lines disagree')
+    if rate < args.target_rate:
+        problems.append(f'rate below target {args.target_rate:.0f}/s')
+
+    for problem in problems:
+        print(f'FAIL: {problem}')
+    if not problems:
+        print('OK')
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""Load test for the storefront: seed a synthetic catalog, drive it, compare runs.
+
+Three steps:
+
+    # 1. Build a database with 10k products (also: 1k, 100k)
+    python benchmarks/load_test.py seed --scale 10k --database benchmarks/data/store-10k.sqlite
+
+    # 2. Serve it (or pass --serve to have the harness start `flask run`) and
+    #    drive it with 32 simulated customers for 60 seconds
+    python benchmarks/load_test.py run --database benchmarks/data/store-10k.sqlite --serve \\
+        --users 32 --seconds 60
+
+    # 3. Compare two saved runs, e.g. before and after a change
+    python benchmarks/load_test.py compare benchmarks/results/a.json benchmarks/results/b.json
+
+Each simulated customer logs in with its own session, then loops over a
+weighted mix of flows: browse /get_products, view /product_details/<id>,
+check out via /add_order + /add_order_items, and list /get_orders.
+Results (requests/s and p50/p95/p99 latency per endpoint) are printed and
+written to benchmarks/results/<time>-<commit>.json.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000}
+SIZES = ['S', 'M', 'L', 'XL']
+COLORS = ['Black', 'White', 'Red', 'Blue', 'Green', 'Grey', 'Navy', 'Beige']
+TYPES = ['T-Shirt', 'Shirt', 'Jeans', 'Jacket', 'Dress', 'Skirt', 'Hoodie', 'Shorts', 'Sweater', 'Coat']
+PASSWORD = 'bench'
+
+# (flow, weight)
+FLOWS = [('browse', 40), ('details', 35), ('checkout', 10), ('orders', 15)]
+
+CHUNK = 5000
+
+
+def database_url(path):
+    return 'sqlite:///' + os.path.abspath(path)
+
+
+def seed(args):
+    from flask import Flask
+    from models import aggregates, db, init_app, search
+    from models.cloth_type import ClothType
+    from models.order import Order
+    from models.order_item import OrderItem
+    from models.product import Product
+    from models.product_size import ProductSize
+    from models.review import Review
+    from models.user import User
+
+    products = SCALES[args.scale]
+    users = max(100, products // 10)
+    orders = products * 2
+    reviews = products * 2
+    if os.path.exists(args.database):
+        sys.exit(f'{args.database} already exists; remove it or pick another path')
+    os.makedirs(os.path.dirname(os.path.abspath(args.database)), exist_ok=True)
+
+    app = Flask(__name__)
+    app.config['DATABASE_URL'] = database_url(args.database)
+    init_app(app)
+    rng = random.Random(args.seed)
+    now = datetime.now()
+
+    def insert(model, rows):
+        for start in range(0, len(rows), CHUNK):
+            db.session.execute(model.__table__.insert(), rows[start:start + CHUNK])
+
+    started = time.perf_counter()
+    with app.app_context():
+        insert(ClothType, [{'id': i, 'type_name': name} for i, name in enumerate(TYPES, 1)])
+        insert(User, [{
+            'id': i, 'username': f'user{i}', 'email': f'user{i}@bench.test', 'password': PASSWORD,
+            'role': 'admin' if i == 1 else 'customer', 'created_at': now - timedelta(days=rng.randrange(365))
+        } for i in range(1, users + 1)])
+        insert(Product, [{
+            'id': i, 'name': f'{rng.choice(COLORS)} {TYPES[i % len(TYPES)]} {i}',
+            'description': f'Synthetic product {i}', 'price': round(rng.uniform(5, 150), 2),
+            'cloth_type_id': i % len(TYPES) + 1, 'color': rng.choice(COLORS), 'created_by': 1,
+            'created_at': now - timedelta(minutes=products - i)
+        } for i in range(1, products + 1)])
+        insert(ProductSize, [{
+            'product_id': i, 'size_label': size, 'stock': rng.randrange(0, 200)
+        } for i in range(1, products + 1) for size in SIZES])
+
+        order_rows, item_rows = [], []
+        for i in range(1, orders + 1):
+            lines = [(rng.randrange(1, products + 1), rng.choice(SIZES), rng.randrange(1, 4))
+                     for _ in range(rng.randrange(1, 4))]
+            order_rows.append({
+                'id': i, 'user_id': rng.randrange(2, users + 1), 'total_amount': 20.0 * len(lines),
+                'order_date': now - timedelta(minutes=rng.randrange(365 * 24 * 60)),
+                'status': rng.choice(['Pending', 'Delivered', 'Delivered', 'Cancelled'])
+            })
+            item_rows += [{'order_id': i, 'product_id': p, 'size_label': s, 'quantity': q, 'price': 20.0}
+                          for p, s, q in lines]
+        insert(Order, order_rows)
+        insert(OrderItem, item_rows)
+        insert(Review, [{
+            'user_id': rng.randrange(2, users + 1), 'product_id': rng.randrange(1, products + 1),
+            'rating': rng.randrange(1, 6), 'comment': 'Synthetic review', 'review_date': now
+        } for _ in range(reviews)])
+
+        aggregates.recompute_all()
+        search.rebuild_search_index()
+        db.session.commit()
+
+    print(f'Seeded {args.database}: {products} products, {users} users, {orders} orders, '
+          f'{len(item_rows)} order lines, {reviews} reviews in {time.perf_counter() - started:.1f}s')
+    with open(args.database + '.json', 'w') as meta:
+        json.dump({'scale': args.scale, 'products': products, 'users': users}, meta)
+
+
+class Customer:
+    """One simulated shopper with its own cookie session."""
+
+    def __init__(self, base_url, user_id, products, rng):
+        self.base_url = base_url.rstrip('/')
+        self.products = products
+        self.rng = rng
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.login(user_id)
+
+    def login(self, user_id):
+        form = urllib.parse.urlencode({'email': f'user{user_id}@bench.test', 'password': PASSWORD}).encode()
+        self.opener.open(self.base_url + '/login', form).read()
+
+    def request(self, samples, name, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req) as response:
+                body = response.read()
+                ok = True
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            ok = e.code < 500
+        except OSError:
+            body, ok = b'', False
+        samples.append((name, time.perf_counter() - started, ok))
+        return body
+
+    def run_flow(self, flow, samples):
+        product_id = self.rng.randrange(1, self.products + 1)
+        if flow == 'browse':
+            self.request(samples, '/get_products', '/get_products')
+        elif flow == 'details':
+            self.request(samples, '/product_details/<id>', f'/product_details/{product_id}')
+        elif flow == 'orders':
+            self.request(samples, '/get_orders', '/get_orders')
+        else:
+            body = self.request(samples, '/add_order', '/add_order', {'total_amount': 20.0})
+            try:
+                order_id = json.loads(body)['order_id']
+            except (ValueError, KeyError):
+                return
+            self.request(samples, '/add_order_items', '/add_order_items', {
+                'order_id': order_id,
+                'items': [{'product_id': product_id, 'size_label': self.rng.choice(SIZES), 'quantity': 1}]
+            })
+
+
+def drive(base_url, user_id, products, deadline, seed_value, samples):
+    rng = random.Random(seed_value)
+    customer = Customer(base_url, user_id, products, rng)
+    flows, weights = zip(*FLOWS)
+    while time.perf_counter() < deadline:
+        customer.run_flow(rng.choices(flows, weights)[0], samples)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples, seconds):
+    endpoints = {}
+    for name in sorted({name for name, _, _ in samples}):
+        latencies = sorted(t for n, t, _ in samples if n == name)
+        errors = sum(1 for n, _, ok in samples if n == name and not ok)
+        endpoints[name] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'rps': round(len(latencies) / seconds, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    return endpoints
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + '/login').read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    sys.exit(f'Server at {url} did not come up')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args):
+    with open(args.database + '.json') as meta:
+        catalog = json.load(meta)
+
+    server = None
+    if args.serve:
+        env = dict(os.environ, DATABASE_URL=database_url(args.database))
+        port = urllib.parse.urlparse(args.url).port or 5000
+        server = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port)],
+                                  cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(args.url)
+        samples = []   # list.append is atomic, so the threads can share it
+        deadline = time.perf_counter() + args.seconds
+        threads = [
+            threading.Thread(target=drive, args=(
+                args.url, 2 + i % (catalog['users'] - 1), catalog['products'], deadline, args.seed + i, samples))
+            for i in range(args.users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    result = {
+        'commit': git_commit(),
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'scale': catalog['scale'],
+        'users': args.users,
+        'seconds': args.seconds,
+        'total_rps': round(len(samples) / args.seconds, 2),
+        'endpoints': summarize(samples, args.seconds),
+    }
+    print_result(result)
+
+    os.makedirs(args.results, exist_ok=True)
+    path = os.path.join(args.results, f"{result['time'].replace(':', '')}-{result['commit']}.json")
+    with open(path, 'w') as out:
+        json.dump(result, out, indent=2)
+    print(f'Saved {path}')
+
+
+def print_result(result):
+    print(f"commit {result['commit']}, {result['scale']} products, {result['users']} users, "
+          f"{result['seconds']}s: {result['total_rps']} req/s")
+    print(f"{'endpoint':<24}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for name, e in result['endpoints'].items():
+        print(f"{name:<24}{e['rps']:>9}{e['p50_ms']:>9}{e['p95_ms']:>9}{e['p99_ms']:>9}{e['errors']:>8}")
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"{before['commit']} -> {after['commit']}")
+    print(f"{'endpoint':<24}{'req/s':>18}{'p95 ms':>18}{'p99 ms':>18}")
+    for name in sorted(set(before['endpoints']) | set(after['endpoints'])):
+        b, a = before['endpoints'].get(name), after['endpoints'].get(name)
+        if not a or not b:
+            print(f'{name:<24} only in {"after" if a else "before"}')
+            continue
+        cells = [f"{b[k]:>8}->{a[k]:<8}" for k in ('rps', 'p95_ms', 'p99_ms')]
+        print(f"{name:<24}" + ' '.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='build a synthetic database')
+    seed_parser.add_argument('--scale', choices=SCALES, default='10k')
+    seed_parser.add_argument('--database', required=True)
+    seed_parser.add_argument('--seed', type=int, default=1)
+    seed_parser.set_defaults(func=seed)
+
+    run_parser = commands.add_parser('run', help='drive a server with simulated customers')
+    run_parser.add_argument('--database', required=True, help='database made by the seed step')
+    run_parser.add_argument('--url', default='http://127.0.0.1:5000')
+    run_parser.add_argument('--serve', action='store_true', help='start `flask run` on the database')
+    run_parser.add_argument('--users', type=int, default=16)
+    run_parser.add_argument('--seconds', type=float, default=30.0)
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--results', default=os.path.join(ROOT, 'benchmarks', 'results'))
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two saved runs')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
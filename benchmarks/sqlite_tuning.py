@@ -0,0 +1,133 @@
+"""Read/write throughput of the SQLite engine settings in models.init_app.
+
+Runs the same mixed workload twice on a scratch database: once with
+the settings the app had before tuning (rollback journal, synchronous=FULL,
+small cache, no mmap, pysqlite's 5 s busy timeout, SQLAlchemy's default
+pool) and once with the tuned defaults from models.SQLITE_DEFAULTS.
+Reader processes page through the catalog while writer processes take
+stock, the way browsing and checkout overlap under gunicorn.
+
+    python benchmarks/sqlite_tuning.py --readers 4 --writers 2 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+SIZES = ['S', 'M', 'L', 'XL']
+
+PROFILES = {
+    'before': {
+        'SQLITE_JOURNAL_MODE': 'DELETE',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_CACHE_SIZE': -2000,
+        'SQLITE_MMAP_SIZE': 0,
+        'SQLITE_BUSY_TIMEOUT': 5000,          # what sqlite3.connect(timeout=5.0) set on its own
+        'SQLALCHEMY_ENGINE_OPTIONS': {},      # no pool_size / max_overflow
+    },
+    'after': {},
+}
+
+# The catalog page query of /get_products_page, with the denormalized stock
+CATALOG_PAGE = (
+    "SELECT p.id, p.name, p.price, t.type_name, p.total_stock "
+    "FROM product p LEFT JOIN cloth_type t ON t.id = p.cloth_type_id "
+    "WHERE p.id > :after ORDER BY p.id LIMIT 24"
+)
+
+
+def make_app(instance_path, profile):
+    from models import init_app
+    app = Flask(__name__, instance_path=instance_path)
+    app.config.update(PROFILES[profile])
+    init_app(app)
+    return app
+
+
+def seed(instance_path, profile, products):
+    from models import db, inventory, run_sql
+    from models.cloth_type import ClothType
+
+    app = make_app(instance_path, profile)
+    with app.app_context():
+        cloth_type = ClothType(type_name='Bench')
+        db.session.add(cloth_type)
+        db.session.flush()
+        run_sql(
+            "INSERT INTO product (id, name, price, cloth_type_id, created_at) "
+            "VALUES (:id, :name, :price, :type_id, CURRENT_TIMESTAMP)",
+            [{'id': i, 'name': f'Product {i}', 'price': 10.0 + i % 50, 'type_id': cloth_type.id}
+             for i in range(1, products + 1)]
+        )
+        for product_id in range(1, products + 1):
+            for size_label in SIZES:
+                inventory.set_stock(product_id, size_label, 1_000_000)
+        db.session.commit()
+
+
+def work(instance_path, profile, role, products, seconds):
+    from models import db, inventory, run_sql
+
+    app = make_app(instance_path, profile)
+    done = errors = 0
+    deadline = time.perf_counter() + seconds
+    with app.app_context():
+        while time.perf_counter() < deadline:
+            try:
+                if role == 'reader':
+                    run_sql(CATALOG_PAGE, {'after': random.randrange(products)}).all()
+                    db.session.rollback()
+                else:
+                    inventory.take_stock(random.randrange(1, products + 1), random.choice(SIZES), 1)
+                    db.session.commit()
+                done += 1
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+    return role, done, errors
+
+
+def run(profile, args):
+    with tempfile.TemporaryDirectory() as instance_path:
+        seed(instance_path, profile, args.products)
+        jobs = [(instance_path, profile, 'reader', args.products, args.seconds)] * args.readers
+        jobs += [(instance_path, profile, 'writer', args.products, args.seconds)] * args.writers
+        with multiprocessing.Pool(len(jobs)) as pool:
+            results = pool.starmap(work, jobs)
+
+    totals = {'reader': [0, 0], 'writer': [0, 0]}
+    for role, done, errors in results:
+        totals[role][0] += done
+        totals[role][1] += errors
+    return {
+        'reads_per_second': totals['reader'][0] / args.seconds,
+        'writes_per_second': totals['writer'][0] / args.seconds,
+        'lock_errors': totals['reader'][1] + totals['writer'][1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    for profile in PROFILES:
+        result = run(profile, args)
+        print(f"{profile:>6}: {result['reads_per_second']:8.0f} reads/s "
+              f"{result['writes_per_second']:8.0f} writes/s "
+              f"{result['lock_errors']:5d} lock errors")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""Response cache for read-heavy endpoints, with tag-based invalidation.
+
+Views decorated with ``@cached('tag', 'product:{product_id}')`` store their
+rendered response under the request path (and the viewer's role), tagged so
+that write routes can drop exactly the entries they affect. Invalidation is
+applied when the database transaction commits, never before, so a reader
+cannot re-cache data that is about to change.
+
+The default backend is an in-process LRU with a TTL. Each worker process has
+its own copy, so with several workers entries may outlive a write in another
+worker by up to CACHE_DEFAULT_TTL; set CACHE_REDIS_URL to share one cache.
+
+Every commit that invalidates catalog tags also bumps the catalog version
+stored in the database. ``@conditional`` turns it into an ETag and
+Last-Modified, and answers revalidation requests with 304 before the view
+runs. Under ``@conditional`` the version is also part of the cache key, so
+a cached body is only ever served with the ETag it was built for, even
+after a change made by another worker.
+"""
+import functools
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+
+from flask import Response, current_app, g, make_response, request, session
+from sqlalchemy import event
+
+import metrics
+from models import db
+from models.catalog_version import bump_catalog_version, current_catalog_version
+
+try:
+    import redis
+except ImportError:  # optional backend
+    redis = None
+
+CACHE_DEFAULTS = {
+    'CACHE_BACKEND': 'memory',   # memory, redis or none
+    'CACHE_REDIS_URL': None,
+    'CACHE_MAX_ENTRIES': 1024,
+    'CACHE_DEFAULT_TTL': 60,     # seconds
+}
+
+
+class MemoryCache:
+    def __init__(self, max_entries, default_ttl):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()   # key -> (value, expires_at, tags)
+        self.tags = {}                 # tag -> set of keys
+        self.epoch = 0                 # bumped on every invalidation
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value, tags, ttl=None, epoch=None):
+        with self.lock:
+            if epoch is not None and epoch != self.epoch:
+                return  # invalidated while the response was being built
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.monotonic() + (ttl or self.default_ttl), tags)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    def current_epoch(self):
+        return self.epoch
+
+    def invalidate(self, tags):
+        with self.lock:
+            self.epoch += 1
+            for tag in tags:
+                for key in self.tags.pop(tag, ()):
+                    if key in self.entries:
+                        self._remove(key)
+                        self.stats['invalidations'] += 1
+
+    def _remove(self, key):
+        _, _, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def info(self):
+        with self.lock:
+            return dict(self.stats, backend='memory', entries=len(self.entries))
+
+
+class RedisCache:
+    # Entries and tag sets live in Redis; hit/miss counters are per process
+    prefix = 'response-cache:'
+
+    def __init__(self, url, default_ttl):
+        self.client = redis.Redis.from_url(url)
+        self.default_ttl = default_ttl
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        self.stats['hits' if raw is not None else 'misses'] += 1
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, tags, ttl=None, epoch=None):
+        if epoch is not None and epoch != self.current_epoch():
+            return
+        ttl = ttl or self.default_ttl
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+        for tag in tags:
+            pipe.sadd(self.prefix + 'tag:' + tag, key)
+            pipe.expire(self.prefix + 'tag:' + tag, ttl)
+        pipe.execute()
+
+    def current_epoch(self):
+        return int(self.client.get(self.prefix + 'epoch') or 0)
+
+    def invalidate(self, tags):
+        self.client.incr(self.prefix + 'epoch')
+        for tag in tags:
+            tag_key = self.prefix + 'tag:' + tag
+            keys = self.client.smembers(tag_key)
+            if keys:
+                self.stats['invalidations'] += self.client.delete(*[self.prefix + k.decode() for k in keys])
+            self.client.delete(tag_key)
+
+    def info(self):
+        return dict(self.stats, backend='redis')
+
+
+def init_app(app):
+    for key, default in CACHE_DEFAULTS.items():
+        app.config.setdefault(key, default)
+
+    backend = None
+    if app.config['CACHE_BACKEND'] == 'redis' or app.config['CACHE_REDIS_URL']:
+        if redis is None:
+            app.logger.warning('redis is not installed, using the in-process response cache')
+        else:
+            backend = RedisCache(app.config['CACHE_REDIS_URL'], app.config['CACHE_DEFAULT_TTL'])
+    if backend is None and app.config['CACHE_BACKEND'] != 'none':
+        backend = MemoryCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_DEFAULT_TTL'])
+    app.extensions['response_cache'] = backend
+
+    @event.listens_for(db.session, 'before_commit')
+    def bump_version(session):
+        # Same transaction as the change, so every worker sees the new version
+        if session.info.get('cache_tags') or session.info.get('changed_products') \
+                or session.info.get('cloth_types_changed'):
+            bump_catalog_version()
+
+    @event.listens_for(db.session, 'after_commit')
+    def invalidate_committed(session):
+        tags = session.info.pop('cache_tags', set())
+        changed = session.info.pop('changed_products', set())
+        if changed:
+            tags |= {'catalog'} | {f'product:{product_id}' for product_id in changed}
+        if session.info.pop('cloth_types_changed', False):
+            tags.add('cloth_types')
+        if tags and backend is not None:
+            backend.invalidate(tags)
+
+    @event.listens_for(db.session, 'after_rollback')
+    def discard_pending(session):
+        session.info.pop('cache_tags', None)
+        session.info.pop('changed_products', None)
+        session.info.pop('cloth_types_changed', None)
+
+
+def backend():
+    return current_app.extensions.get('response_cache')
+
+
+def invalidate(*tags):
+    """Drop entries with any of ``tags`` once the current transaction commits."""
+    db.session.info.setdefault('cache_tags', set()).update(tags)
+
+
+def tag(*tags):
+    """Add tags to the response being cached, from inside a cached view."""
+    if 'cache_tags' in g:
+        g.cache_tags.extend(tags)
+
+
+def stats():
+    cache = backend()
+    return cache.info() if cache is not None else {'backend': 'none'}
+
+
+def conditional(view):
+    """ETag / Last-Modified from the catalog version, with 304 for unchanged data."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, updated_at = current_catalog_version()
+        g.catalog_version = version   # picked up by @cached below
+        # Admins and customers get different pages for the same URL
+        etag = f"{version}-{session.get('role') or 'guest'}"
+        last_modified = updated_at.astimezone(timezone.utc).replace(microsecond=0)
+
+        # If-None-Match wins over If-Modified-Since when both are sent
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = bool(request.if_modified_since) and last_modified <= request.if_modified_since
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True   # always revalidate, usually for a 304
+        response.vary.add('Cookie')
+        return response
+    return wrapper
+
+
+def cached(*tags, ttl=None):
+    """Cache a view's 200 responses, tagged with ``tags`` formatted with its URL arguments."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = backend()
+            if cache is None:
+                return view(*args, **kwargs)
+
+            # Pages differ for admins and customers. The catalog version read by
+            # @conditional keys the entry too: the body was built no earlier
+            # than that version, so it always matches the ETag sent with it
+            key = f"{request.full_path}|{session.get('role')}"
+            if 'catalog_version' in g:
+                key += f'|v{g.catalog_version}'
+            hit = cache.get(key)
+            metrics.inc('cache_requests', result='miss' if hit is None else 'hit')
+            if hit is not None:
+                body, status, mimetype = hit
+                return Response(body, status=status, mimetype=mimetype)
+
+            epoch = cache.current_epoch()
+            g.cache_tags = [t.format(**kwargs) for t in tags]
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.set(key, (response.get_data(), response.status_code, response.mimetype),
+                          g.cache_tags, ttl, epoch)
+            return response
+        return wrapper
+    return decorator
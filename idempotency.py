@@ -0,0 +1,112 @@
+"""Idempotency keys for order-creating requests.
+
+A client that may retry sends an ``Idempotency-Key`` header (any unique
+string, e.g. a UUID per checkout attempt). The first request with a key
+claims it in the same transaction as its work. Its response is stored
+once it finishes. A retry with the same key and the same body gets the
+stored response back without running again. A retry that arrives while
+the first request is still running gets 409. Reusing a key for a
+different request gets 422.
+
+Keys expire after IDEMPOTENCY_KEY_TTL seconds. Each worker process purges
+expired keys from a background thread every IDEMPOTENCY_PURGE_INTERVAL
+seconds; ``flask purge-idempotency-keys`` does the same on demand.
+"""
+import functools
+import hashlib
+import os
+import threading
+import time
+
+from flask import Response, current_app, jsonify, make_response, request, session
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db
+from models.idempotency_key import claim_key, find_key, purge_expired_keys, save_response
+
+IDEMPOTENCY_DEFAULTS = {
+    'IDEMPOTENCY_KEY_TTL': 24 * 3600,        # seconds a stored response can be replayed
+    'IDEMPOTENCY_PURGE_INTERVAL': 600,       # seconds between background purges
+}
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 100
+
+_cleaner_pid = None
+_cleaner_lock = threading.Lock()
+
+
+def init_app(app):
+    for key, default in IDEMPOTENCY_DEFAULTS.items():
+        app.config.setdefault(key, default)
+
+
+def idempotent(view):
+    """Replay the stored response for a repeated Idempotency-Key instead of running ``view``."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{HEADER} is longer than {MAX_KEY_LENGTH} characters'}), 400
+        _start_cleaner()
+
+        user_id = session.get('user_id') or 0
+        request_hash = hashlib.sha256(
+            request.method.encode() + b' ' + request.path.encode() + b'\n' + request.get_data()
+        ).hexdigest()
+
+        if not claim_key(user_id, key, request_hash):
+            existing = find_key(user_id, key)
+            db.session.rollback()
+            if existing is not None and existing.request_hash != request_hash:
+                return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+            if existing is None or existing.status_code is None:
+                return jsonify({'error': 'A request with this key is still being processed'}), 409
+            response = Response(existing.response_body, status=existing.status_code, mimetype=existing.mimetype)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code >= 500 or response.is_streamed:
+            # Outcome unknown: leave any committed claim in place, so a retry
+            # gets 409 rather than repeating work that may have happened
+            db.session.rollback()
+            return response
+
+        save_response(user_id, key, request_hash, response.status_code,
+                      response.get_data(as_text=True), response.mimetype)
+        db.session.commit()
+        return response
+    return wrapper
+
+
+def _start_cleaner():
+    # One purge thread per worker process, started lazily so it survives a
+    # fork from a preloading master
+    global _cleaner_pid
+    if _cleaner_pid == os.getpid():
+        return
+    with _cleaner_lock:
+        if _cleaner_pid == os.getpid():
+            return
+        _cleaner_pid = os.getpid()
+        threading.Thread(target=_purge_loop, args=(current_app._get_current_object(),),
+                         name='idempotency-purge', daemon=True).start()
+
+
+def _purge_loop(app):
+    while True:
+        time.sleep(app.config['IDEMPOTENCY_PURGE_INTERVAL'])
+        with app.app_context():
+            try:
+                purged = purge_expired_keys(app.config['IDEMPOTENCY_KEY_TTL'])
+                db.session.commit()
+                if purged:
+                    app.logger.info('Purged %d expired idempotency keys', purged)
+            except SQLAlchemyError:
+                db.session.rollback()
+                app.logger.exception('Could not purge idempotency keys')
+            finally:
+                db.session.remove()
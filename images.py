@@ -0,0 +1,218 @@
+"""Product image uploads: content-addressed storage and resized variants.
+
+An upload is stored once under the SHA-256 of its bytes
+(uploads/<hash>.<ext>), so re-uploading the same picture costs nothing.
+Resized copies (uploads/<hash>_w<width>.<format>) are produced by a small
+background thread pool. Their names are derived from the hash, so listings
+can link them right away. Until a variant exists, the uploads route serves
+the original in its place.
+
+Pillow is optional: without it uploads are still deduplicated but no
+variants are produced and variant_urls() returns nothing.
+
+Because hashed names never change content, send_upload() marks them
+immutable for a year. Behind nginx, UPLOADS_ACCEL_REDIRECT hands the bytes
+to the proxy; Flask's own USE_X_SENDFILE does the same for Apache/lighttpd.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Response, abort, current_app, send_from_directory
+from werkzeug.utils import secure_filename
+
+try:
+    from PIL import Image, features
+except ImportError:  # optional dependency
+    Image = None
+
+IMAGE_DEFAULTS = {
+    'IMAGE_VARIANT_WIDTHS': (200, 400, 800),
+    'IMAGE_VARIANT_FORMATS': ('avif', 'webp'),   # dropped if Pillow cannot write them
+    'IMAGE_WORKERS': 2,
+    'UPLOADS_IMMUTABLE_MAX_AGE': 365 * 24 * 3600,   # content-addressed files
+    'UPLOADS_MAX_AGE': 3600,                        # legacy names, may be replaced
+    'UPLOADS_PENDING_MAX_AGE': 60,                  # original standing in for a variant
+    'UPLOADS_ACCEL_REDIRECT': None,                 # e.g. '/protected-uploads/' for nginx
+}
+
+HASHED_NAME = re.compile(r'^(?P<digest>[0-9a-f]{64})\.\w+$')
+VARIANT_NAME = re.compile(r'^(?P<digest>[0-9a-f]{64})_w(?P<width>\d+)\.(?P<format>\w+)$')
+
+ORIGINAL_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.avif', '.gif', '.bin')
+
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60},
+}
+
+_executor = None
+
+
+def init_app(app):
+    global _executor
+    for key, default in IMAGE_DEFAULTS.items():
+        app.config.setdefault(key, default)
+    app.config['IMAGE_VARIANT_FORMATS'] = tuple(
+        fmt for fmt in app.config['IMAGE_VARIANT_FORMATS'] if _can_write(fmt)
+    )
+    if Image is None:
+        app.logger.warning('Pillow is not installed, image variants are disabled')
+    _executor = ThreadPoolExecutor(max_workers=app.config['IMAGE_WORKERS'], thread_name_prefix='images')
+
+
+def _can_write(fmt):
+    if Image is None:
+        return False
+    if fmt == 'webp':
+        return features.check('webp')
+    Image.init()
+    return SAVE_OPTIONS[fmt]['format'] in Image.SAVE
+
+
+def store_upload(file_storage):
+    """Save an uploaded file under its content hash; returns its image_url."""
+    folder = current_app.config['UPLOAD_FOLDER']
+    extension = os.path.splitext(secure_filename(file_storage.filename))[1].lower() or '.bin'
+
+    # Hash while writing to a temp file, so large uploads are never held in memory
+    digest = hashlib.sha256()
+    handle, temp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            for chunk in iter(lambda: file_storage.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        filename = digest.hexdigest() + extension
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    schedule_variants(filename)
+    return os.path.join('uploads', filename)
+
+
+def schedule_variants(filename):
+    if Image is None or _executor is None:
+        return
+    config = current_app.config
+    _executor.submit(
+        generate_variants, current_app._get_current_object(), config['UPLOAD_FOLDER'], filename,
+        config['IMAGE_VARIANT_WIDTHS'], config['IMAGE_VARIANT_FORMATS']
+    )
+
+
+def generate_variants(app, folder, filename, widths, formats):
+    digest = HASHED_NAME.match(filename).group('digest')
+    try:
+        with Image.open(os.path.join(folder, filename)) as original:
+            original.load()
+            if original.mode not in ('RGB', 'RGBA'):
+                original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+            for width in widths:
+                resized = original.copy()
+                resized.thumbnail((width, width * 4))   # keeps aspect ratio, never upscales
+                for fmt in formats:
+                    target = os.path.join(folder, f'{digest}_w{width}.{fmt}')
+                    if os.path.exists(target):
+                        continue
+                    temp_path = target + '.part'
+                    resized.save(temp_path, **SAVE_OPTIONS[fmt])
+                    os.replace(temp_path, target)
+    except Exception:
+        app.logger.exception('Could not generate variants for %s', filename)
+
+
+def adopt_legacy_image(image_url):
+    """Copy a pre-pipeline upload to its content-addressed name.
+
+    Returns the new image_url (or the old one if the file is missing) and
+    generates the variants synchronously. The old file is left in place.
+    """
+    folder = current_app.config['UPLOAD_FOLDER']
+    filename = os.path.basename(image_url)
+    path = os.path.join(folder, filename)
+    if not HASHED_NAME.match(filename):
+        if not os.path.exists(path):
+            return image_url
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(64 * 1024), b''):
+                digest.update(chunk)
+        hashed = digest.hexdigest() + (os.path.splitext(filename)[1].lower() or '.bin')
+        if not os.path.exists(os.path.join(folder, hashed)):
+            shutil.copyfile(path, os.path.join(folder, hashed))
+        filename = hashed
+
+    if Image is not None:
+        config = current_app.config
+        generate_variants(current_app._get_current_object(), folder, filename,
+                          config['IMAGE_VARIANT_WIDTHS'], config['IMAGE_VARIANT_FORMATS'])
+    return os.path.join('uploads', filename)
+
+
+def variant_urls(image_url):
+    """{format: {width: url}} for a content-addressed image, else {}."""
+    if not image_url:
+        return {}
+    match = HASHED_NAME.match(os.path.basename(image_url))
+    config = current_app.config
+    if not match or not config['IMAGE_VARIANT_FORMATS']:
+        return {}
+    digest = match.group('digest')
+    return {
+        fmt: {width: f'/uploads/{digest}_w{width}.{fmt}' for width in config['IMAGE_VARIANT_WIDTHS']}
+        for fmt in config['IMAGE_VARIANT_FORMATS']
+    }
+
+
+def send_upload(filename):
+    """Serve a file from the uploads folder with caching suited to its name."""
+    config = current_app.config
+    folder = config['UPLOAD_FOLDER']
+    fingerprinted = bool(HASHED_NAME.match(filename) or VARIANT_NAME.match(filename))
+    max_age = config['UPLOADS_IMMUTABLE_MAX_AGE'] if fingerprinted else config['UPLOADS_MAX_AGE']
+
+    if not os.path.exists(os.path.join(folder, filename)):
+        # A variant that is not generated yet: serve the original, briefly
+        original = original_for(filename)
+        if original is None:
+            abort(404)
+        filename, fingerprinted, max_age = original, False, config['UPLOADS_PENDING_MAX_AGE']
+
+    if config['UPLOADS_ACCEL_REDIRECT']:
+        # nginx streams the file and handles Range / If-None-Match itself
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = config['UPLOADS_ACCEL_REDIRECT'].rstrip('/') + '/' + filename
+    else:
+        # conditional=True gives ETag/Last-Modified, 304s and Range requests
+        response = send_from_directory(folder, filename, max_age=max_age, conditional=True)
+
+    cache_control = f'public, max-age={max_age}'
+    if fingerprinted:
+        cache_control += ', immutable'
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def original_for(filename):
+    """The stored original a missing variant file stands in for, if any."""
+    match = VARIANT_NAME.match(filename)
+    if not match:
+        return None
+    folder = current_app.config['UPLOAD_FOLDER']
+    for extension in ORIGINAL_EXTENSIONS:
+        name = match.group('digest') + extension
+        if os.path.exists(os.path.join(folder, name)):
+            return name
+    return None
@@ -0,0 +1,117 @@
+"""Prometheus metrics: request latency, in-flight requests, DB time and shop counters.
+
+Served at /metrics in the Prometheus text format. With several worker
+processes (gunicorn), set PROMETHEUS_MULTIPROC_DIR to an empty directory
+shared by the workers. Each worker then writes its samples there and
+/metrics merges all of them, whichever worker answers the scrape. Clear
+the directory before starting the server. Also call
+``prometheus_client.multiprocess.mark_process_dead(worker.pid)`` from
+gunicorn's ``child_exit`` hook so dead workers drop out of the in-flight
+gauge.
+
+prometheus_client is optional: without it the hooks do nothing and
+/metrics answers 503.
+"""
+import os
+import time
+
+from flask import Response, g, request
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:  # optional dependency
+    prometheus_client = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_metrics = {}
+
+
+def _define():
+    # Metrics are process-wide singletons; define them once
+    if _metrics:
+        return
+    _metrics.update(
+        request_latency=Histogram(
+            'http_request_duration_seconds', 'Request latency', ['endpoint', 'method', 'status'],
+            buckets=LATENCY_BUCKETS),
+        in_progress=Gauge(
+            'http_requests_in_progress', 'Requests being handled', multiprocess_mode='livesum'),
+        db_time=Histogram(
+            'http_request_db_seconds', 'Time spent in SQL per request', ['endpoint'],
+            buckets=DB_TIME_BUCKETS),
+        db_queries=Counter(
+            'db_queries', 'SQL statements issued', ['endpoint']),
+        orders_placed=Counter(
+            'orders_placed', 'Orders created', ['route']),
+        stock_failures=Counter(
+            'checkout_stock_failures', 'Checkouts rejected for lack of stock', ['route']),
+        orders_cancelled=Counter(
+            'orders_cancelled', 'Pending orders cancelled', ['by']),
+        cache_requests=Counter(
+            'response_cache_requests', 'Response cache lookups', ['result']),
+    )
+
+
+def init_app(app):
+    if prometheus_client is None:
+        app.logger.warning('prometheus_client is not installed, /metrics is disabled')
+        app.add_url_rule('/metrics', 'metrics', lambda: ('prometheus_client is not installed', 503))
+        return
+    _define()
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        _metrics['in_progress'].inc()
+
+    @app.after_request
+    def note_response(response):
+        g.metrics_status = response.status_code
+        # A streamed body is sent (and runs its queries) after the view
+        # returns; the request context is torn down once now and again when
+        # the stream ends, and only the second teardown sees the whole request
+        if response.is_streamed:
+            g.metrics_streaming = True
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if g.pop('metrics_streaming', False):
+            return
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        _metrics['in_progress'].dec()
+        endpoint = request.endpoint or 'unmatched'
+        status = g.pop('metrics_status', 500)
+        _metrics['request_latency'].labels(endpoint, request.method, str(status)) \
+            .observe(time.perf_counter() - started)
+        # Collected by models.instrumentation for the same request; this
+        # teardown runs before its record_sql_stats, which pops them
+        queries = g.get('sql_queries')
+        if queries is not None:
+            _metrics['db_time'].labels(endpoint).observe(sum(ms for ms, _ in queries) / 1000)
+            _metrics['db_queries'].labels(endpoint).inc(len(queries))
+
+    app.add_url_rule('/metrics', 'metrics', expose)
+
+
+def expose():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        # Merge the samples every worker has written
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry),
+                    content_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def inc(name, amount=1, **labels):
+    """Increment one of the shop counters, e.g. ``inc('orders_placed', route='checkout')``."""
+    metric = _metrics.get(name)
+    if metric is not None:
+        (metric.labels(**labels) if labels else metric).inc(amount)
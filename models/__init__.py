@@ -1,20 +1,114 @@
+import os
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, make_url, text
 
 db = SQLAlchemy()
 
+# Engine settings, each overridable from app.config or an environment
+# variable of the same name
+SQLITE_DEFAULTS = {
+    'DATABASE_URL': 'sqlite:///clothing_store.sqlite',
+    'SQLITE_JOURNAL_MODE': 'WAL',         # readers no longer wait for writers
+    'SQLITE_SYNCHRONOUS': 'NORMAL',       # safe with WAL, one fsync per checkpoint
+    'SQLITE_BUSY_TIMEOUT': 5000,          # ms to wait for a lock before "database is locked"
+    'SQLITE_CACHE_SIZE': -64000,          # negative = KiB, so 64 MB of page cache per connection
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_POOL_SIZE': 5,                # connections kept open per worker process
+    'SQLITE_MAX_OVERFLOW': 10,
+    'SQLITE_ARCHIVE_PATH': '',            # archived orders; default <database>_archive.sqlite
+}
+
+# Applied to every new connection; journal_mode is persistent and set once
+CONNECTION_PRAGMAS = {
+    'busy_timeout': 'SQLITE_BUSY_TIMEOUT',
+    'synchronous': 'SQLITE_SYNCHRONOUS',
+    'cache_size': 'SQLITE_CACHE_SIZE',
+    'mmap_size': 'SQLITE_MMAP_SIZE',
+}
+
+
+def load_settings(app):
+    for key, default in SQLITE_DEFAULTS.items():
+        value = app.config.get(key, os.environ.get(key, default))
+        app.config[key] = type(default)(value)
+
+
+def configure_engine(app, engine):
+    from .archive import SCHEMA, archive_path
+
+    pragmas = {name: app.config[key] for name, key in CONNECTION_PRAGMAS.items()}
+    archive = app.config['SQLITE_ARCHIVE_PATH'] or archive_path(engine.url.database)
+
+    @event.listens_for(engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        # SQLite only enforces foreign keys when asked to, per connection
+        cursor.execute('PRAGMA foreign_keys=ON')
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        # Old orders live in a second file, queried through the same connection
+        cursor.execute(f'ATTACH DATABASE ? AS {SCHEMA}', (archive,))
+        cursor.execute(f"PRAGMA {SCHEMA}.synchronous={pragmas['synchronous']}")
+        cursor.close()
+
+    with engine.connect() as connection:
+        mode = connection.exec_driver_sql(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}").scalar()
+        connection.exec_driver_sql(f"PRAGMA {SCHEMA}.journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+    app.logger.debug('%s: journal_mode=%s %s, archive %s', engine.url, mode, pragmas, archive)
+
+
+def run_sql(sql, params=None):
+    # Raw SQL has to go through the same engine as the models (bind 'db'),
+    # otherwise it runs on a second connection outside the session's transaction
+    from .product import Product
+    return db.session.execute(text(sql), params or {}, bind_arguments={'mapper': Product})
+
+
+def mark_products_changed(product_ids):
+    # Noted on the session; listeners (e.g. the response cache) act on
+    # them once the transaction commits
+    db.session.info.setdefault('changed_products', set()).update(product_ids)
+
+
+def mark_cloth_types_changed():
+    db.session.info['cloth_types_changed'] = True
+
 
 def init_app(app):
     # Configure the DB here or in app.py
+    load_settings(app)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SQLALCHEMY_BINDS'] = {
-        'db': "sqlite:///clothing_store.sqlite"
+        'db': app.config['DATABASE_URL']
     }
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///clothing_store.sqlite'
+    app.config['SQLALCHEMY_DATABASE_URI'] = app.config['DATABASE_URL']
+    if make_url(app.config['DATABASE_URL']).database not in (None, '', ':memory:'):
+        # File databases get a QueuePool; in-memory ones keep SQLAlchemy's default
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'pool_size': app.config['SQLITE_POOL_SIZE'],
+            'max_overflow': app.config['SQLITE_MAX_OVERFLOW'],
+        })
 
     db.init_app(app)
     app.logger.info('Initialized models')
 
     with app.app_context():
+        for engine in db.engines.values():
+            configure_engine(app, engine)
+
+        from .instrumentation import init_app as init_instrumentation
+        init_instrumentation(app, db.engines.values())
+
+        # A worker forked from a preloaded master must not share its
+        # parent's SQLite connections, so the child drops the inherited pool
+        engines = list(db.engines.values())
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=lambda: [e.dispose(close=False) for e in engines])
+
         from .user import User
         from .cloth_type import ClothType
         from .product import Product
@@ -22,6 +116,17 @@ def init_app(app):
         from .order import Order
         from .order_item import OrderItem
         from .review import Review
+        from .stock_reservation import StockReservation
+        from .idempotency_key import IdempotencyKey
+        from .recommendations import ProductCoPurchase, ProductRecommendation
+        from .sales_rollups import DailySales
+        from .archive import ArchivedOrder, ArchivedOrderItem
+        from .catalog_version import CatalogVersion, ensure_catalog_version
+        from .migrations import upgrade_schema
+        from .search import create_search_index
         db.create_all()
+        upgrade_schema(app)
+        create_search_index(app)
+        ensure_catalog_version()
         db.session.commit()
         app.logger.debug('All tables are created')
@@ -0,0 +1,86 @@
+"""Per-product totals stored on the product row.
+
+Product.total_stock mirrors SUM(product_size.stock); review_count and
+rating_sum mirror the product's reviews. They change in the same
+transaction as the rows they summarize, so listings read one row per
+product. find_drift() and recompute_all() back the consistency check.
+"""
+from sqlalchemy import func, or_, select, update
+
+from . import db, mark_products_changed
+from .product import Product
+from .product_size import ProductSize
+from .review import Review
+
+
+def _stock_sum():
+    return select(func.coalesce(func.sum(ProductSize.stock), 0)) \
+        .where(ProductSize.product_id == Product.id).scalar_subquery()
+
+
+def _review_count(*conditions):
+    return select(func.count(Review.id)) \
+        .where(Review.product_id == Product.id, *conditions).scalar_subquery()
+
+
+def _rating_sum(*conditions):
+    return select(func.coalesce(func.sum(Review.rating), 0)) \
+        .where(Review.product_id == Product.id, *conditions).scalar_subquery()
+
+
+def _update(statement):
+    db.session.execute(statement.execution_options(synchronize_session=False))
+
+
+def adjust_total_stock(product_id, delta):
+    mark_products_changed([product_id])
+    _update(update(Product).where(Product.id == product_id)
+            .values(total_stock=Product.total_stock + delta))
+
+
+def refresh_total_stock(product_ids):
+    """Recompute total_stock for ``product_ids`` (a list or a select of ids)."""
+    if not isinstance(product_ids, (list, tuple, set)):
+        product_ids = db.session.execute(product_ids).scalars().all()
+    mark_products_changed(product_ids)
+    _update(update(Product).where(Product.id.in_(product_ids))
+            .values(total_stock=_stock_sum()))
+
+
+def record_review(product_id, rating):
+    mark_products_changed([product_id])
+    _update(update(Product).where(Product.id == product_id).values(
+        review_count=Product.review_count + 1,
+        rating_sum=Product.rating_sum + (rating or 0)
+    ))
+
+
+def forget_user_reviews(user_id):
+    # Call before deleting a user: their reviews go with them (ON DELETE CASCADE)
+    by_user = Review.user_id == user_id
+    mark_products_changed(db.session.execute(select(Review.product_id).where(by_user)).scalars().all())
+    _update(update(Product).where(Product.id.in_(select(Review.product_id).where(by_user))).values(
+        review_count=Product.review_count - _review_count(by_user),
+        rating_sum=Product.rating_sum - _rating_sum(by_user)
+    ))
+
+
+def find_drift():
+    """Products whose stored aggregates differ from a fresh recount."""
+    stock, count, rating = _stock_sum(), _review_count(), _rating_sum()
+    return db.session.execute(
+        select(Product.id, Product.total_stock, stock, Product.review_count, count,
+               Product.rating_sum, rating)
+        .where(or_(Product.total_stock != stock,
+                   Product.review_count != count,
+                   Product.rating_sum != rating))
+        .order_by(Product.id)
+    ).all()
+
+
+def recompute_all():
+    _update(update(Product).values(
+        total_stock=_stock_sum(),
+        review_count=_review_count(),
+        rating_sum=_rating_sum()
+    ))
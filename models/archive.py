@@ -0,0 +1,163 @@
+"""Old orders moved out of the hot tables into an attached archive database.
+
+Every connection ATTACHes the archive file as schema ``archive`` (see
+configure_engine), which holds copies of the ``order`` and
+``order_item`` tables. archive_orders() moves Delivered and Cancelled
+orders older than a cutoff, with their items, in chunks of one
+transaction each. Order listings read the hot table first and only
+reach into the archive once a page goes back past the newest archived
+order.
+
+In WAL mode SQLite commits the two files separately. A crash mid-commit
+can leave a chunk in both databases; the next run treats copies that
+already exist and match the hot rows as archived and deletes the hot rows.
+Order ids are AUTOINCREMENT, so a new order never takes the id of an
+archived one.
+"""
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import aliased
+
+from . import db
+from .order import Order
+from .order_item import OrderItem
+
+SCHEMA = 'archive'
+ARCHIVE_AFTER_DAYS = 180
+BATCH_SIZE = 500
+ARCHIVED_STATUSES = ('delivered', 'cancelled')
+
+
+def archive_path(database):
+    # clothing_store.sqlite -> clothing_store_archive.sqlite, next to it
+    if database in (None, '', ':memory:'):
+        return ':memory:'
+    root, ext = os.path.splitext(database)
+    return f'{root}_archive{ext}'
+
+
+class ArchivedOrder(db.Model):
+    # Same columns as Order; no foreign key to user, which lives in the
+    # main database
+    __bind_key__ = 'db'
+    __tablename__ = 'order'
+    __table_args__ = {'schema': SCHEMA}
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer)
+    order_date = db.Column(db.TIMESTAMP)
+    total_amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+
+
+class ArchivedOrderItem(db.Model):
+    __bind_key__ = 'db'
+    __tablename__ = 'order_item'
+    __table_args__ = {'schema': SCHEMA}
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_id = db.Column(db.Integer, db.ForeignKey(f'{SCHEMA}.order.id', ondelete='CASCADE'))
+    product_id = db.Column(db.Integer)
+    size_label = db.Column(db.String(10))
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+
+
+# The same indexes as the hot tables (index names are per database file)
+db.Index('ix_archive_order_order_date', ArchivedOrder.order_date)
+db.Index('ix_archive_order_item_order_id', ArchivedOrderItem.order_id)
+db.Index('ix_archive_order_user_id_order_date', ArchivedOrder.user_id, ArchivedOrder.order_date.desc())
+db.Index('ix_archive_order_status_order_date',
+         func.lower(func.trim(ArchivedOrder.status)), ArchivedOrder.order_date.desc())
+
+
+def archive_after_days():
+    return current_app.config.get('ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS)
+
+
+def _columns(model):
+    return [column.name for column in model.__table__.columns]
+
+
+def _same_row(model, archived_model):
+    # Both sides of the comparison share a table name, so archived_model
+    # must be an alias
+    return [getattr(model, c).is_not_distinct_from(getattr(archived_model, c)) for c in _columns(model)]
+
+
+def archive_orders(older_than_days=None, batch_size=BATCH_SIZE, progress=None):
+    """Move old Delivered/Cancelled orders and their items to the archive; returns the count.
+
+    Only orders whose copy is known to be in the archive are deleted. An
+    archived order with the same id but different contents means ids were
+    reused; the chunk is rolled back and RuntimeError raised rather than
+    losing either order.
+    """
+    if older_than_days is None:
+        older_than_days = archive_after_days()
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    eligible = (func.lower(func.trim(Order.status)).in_(ARCHIVED_STATUSES), Order.order_date < cutoff)
+    order_columns, item_columns = _columns(Order), _columns(OrderItem)
+    archived_order = aliased(ArchivedOrder, name='archived_order')
+    archived_item = aliased(ArchivedOrderItem, name='archived_order_item')
+
+    moved = 0
+    while True:
+        ids = db.session.execute(
+            select(Order.id).where(*eligible).order_by(Order.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        # The copy starts the write transaction and re-checks the status,
+        # in case an order changed since it was picked
+        copied = set(db.session.execute(insert(ArchivedOrder).from_select(
+            order_columns,
+            select(*[getattr(Order, c) for c in order_columns]).where(Order.id.in_(ids), *eligible)
+        ).on_conflict_do_nothing().returning(ArchivedOrder.id)).scalars())
+        # Ids already in the archive are leftovers of an interrupted run
+        # only if the copy is identical
+        skipped = [i for i in ids if i not in copied]
+        leftovers = set(db.session.execute(
+            select(Order.id).join(archived_order, archived_order.id == Order.id)
+            .where(Order.id.in_(skipped), *eligible, *_same_row(Order, archived_order))
+        ).scalars()) if skipped else set()
+        clashes = db.session.execute(
+            select(archived_order.id).where(archived_order.id.in_(set(skipped) - leftovers))
+            .join(Order, Order.id == archived_order.id).where(*eligible)
+        ).scalars().all() if skipped else []
+        if clashes:
+            db.session.rollback()
+            raise RuntimeError(f'archive already holds different orders with ids {clashes}')
+        archived = copied | leftovers
+
+        db.session.execute(insert(ArchivedOrderItem).from_select(
+            item_columns,
+            select(*[getattr(OrderItem, c) for c in item_columns]).where(OrderItem.order_id.in_(archived))
+        ).on_conflict_do_nothing())
+        missing = db.session.execute(
+            select(OrderItem.id).where(OrderItem.order_id.in_(archived)).outerjoin(
+                archived_item, and_(archived_item.id == OrderItem.id, *_same_row(OrderItem, archived_item))
+            ).where(archived_item.id.is_(None))
+        ).scalars().all()
+        if missing:
+            db.session.rollback()
+            raise RuntimeError(f'archive already holds different order items with ids {missing}')
+
+        db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(archived)))
+        result = db.session.execute(delete(Order).where(Order.id.in_(archived)))
+        db.session.commit()
+
+        moved += result.rowcount
+        if progress:
+            progress(moved)
+        if len(ids) < batch_size:
+            break
+    return moved
+
+
+def newest_archived(query):
+    """Latest order_date among the archived orders matched by ``query``, or None."""
+    return query.with_entities(func.max(ArchivedOrder.order_date)).scalar()
@@ -0,0 +1,274 @@
+"""Bulk catalog import and export (CSV or JSON Lines).
+
+One record per product:
+
+    id, name, description, price, cloth_type, color, image_url, sizes
+
+``id`` is optional. A record with an id upserts that product; a record
+without one creates a new product. ``cloth_type`` is matched by name
+(case-insensitive) and created if unknown. ``sizes`` is ``S:10;M:5`` in CSV
+or ``{"S": 10, "M": 5}`` in JSONL. The listed sizes are set to those stock
+levels; sizes not listed are left alone.
+
+Input is read row by row and written in batches: each batch is a few
+executemany statements and one commit. A bad row is reported with its
+line number and skipped; the rest of the import goes on. A batch the
+database rejects is retried one row at a time, so only the offending
+rows are lost.
+"""
+import codecs
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import String, cast, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db, inventory, mark_cloth_types_changed, mark_products_changed
+from .cloth_type import ClothType
+from .product import Product
+from .product_size import ProductSize
+from .search import reindex_products
+
+FIELDS = ['id', 'name', 'description', 'price', 'cloth_type', 'color', 'image_url', 'sizes']
+PRODUCT_COLUMNS = ['name', 'description', 'price', 'cloth_type_id', 'color', 'image_url']
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+# ---------------- Reading ----------------
+def read_records(stream, fmt):
+    """Yield (line number, record dict or error message) from a binary stream."""
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, f'Invalid JSON: {e}'
+                continue
+            yield line_no, record if isinstance(record, dict) else 'Each line must be a JSON object'
+    else:
+        raise ValueError(f'Unknown format: {fmt}')
+
+
+def parse_sizes(value):
+    # {"S": 10} or "S:10;M:5" -> {'S': 10, 'M': 5}
+    if value in (None, ''):
+        return {}
+    if isinstance(value, dict):
+        items = value.items()
+    else:
+        items = [part.split(':', 1) for part in str(value).split(';') if part.strip()]
+        if any(len(item) != 2 for item in items):
+            raise ValueError('sizes must look like S:10;M:5')
+    sizes = {}
+    for label, stock in items:
+        stock = int(stock)
+        if stock < 0:
+            raise ValueError('stock cannot be negative')
+        sizes[str(label).strip()] = stock
+    return sizes
+
+
+def clean_record(record):
+    """Validated product fields plus sizes; raises ValueError with a readable message."""
+    def text(key):
+        value = record.get(key)
+        return str(value).strip() if value not in (None, '') else None
+
+    name = text('name')
+    if not name:
+        raise ValueError('name is required')
+    try:
+        price = float(record.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError('price must be a number')
+    if price < 0:
+        raise ValueError('price cannot be negative')
+    product_id = text('id')
+    try:
+        sizes = parse_sizes(record.get('sizes'))
+    except ValueError as e:
+        raise ValueError(f'sizes: {e}')
+    return {
+        'id': int(product_id) if product_id else None,
+        'name': name,
+        'description': text('description'),
+        'price': price,
+        'cloth_type': text('cloth_type'),
+        'color': text('color'),
+        'image_url': text('image_url'),
+        'sizes': sizes,
+    }
+
+
+# ---------------- Importing ----------------
+class CatalogImport:
+    def __init__(self, created_by=None, batch_size=BATCH_SIZE):
+        self.created_by = created_by
+        self.batch_size = batch_size
+        self.created = self.upserted = self.error_count = 0
+        self.errors = []
+        self._load_cloth_types()
+
+    def _load_cloth_types(self):
+        self.cloth_types = {name.strip().lower(): type_id for type_id, name in
+                            db.session.execute(select(ClothType.id, ClothType.type_name)).all()}
+
+    def error(self, line_no, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_no, 'error': message})
+
+    def run(self, records):
+        batch = []
+        for line_no, record in records:
+            if isinstance(record, str):
+                self.error(line_no, record)
+                continue
+            try:
+                batch.append((line_no, clean_record(record)))
+            except ValueError as e:
+                self.error(line_no, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+        return self.summary()
+
+    def cloth_type_id(self, name):
+        if name is None:
+            return None
+        key = name.lower()
+        if key not in self.cloth_types:
+            self.cloth_types[key] = db.session.execute(
+                insert(ClothType).values(type_name=name).returning(ClothType.id)
+            ).scalar_one()
+            mark_cloth_types_changed()
+        return self.cloth_types[key]
+
+    def write_batch(self, batch):
+        try:
+            existing, new = self._write(batch)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            self._load_cloth_types()   # types created in this batch were rolled back too
+            if len(batch) > 1:
+                for line in batch:
+                    self.write_batch([line])
+                return
+            [(line_no, _)] = batch
+            self.error(line_no, f'not imported: {e.__class__.__name__}: {e.orig if hasattr(e, "orig") else e}')
+            return
+        self.upserted += existing
+        self.created += new
+
+    def _write(self, batch):
+        # One transaction for the whole batch; returns (upserted, created)
+        now = datetime.now()
+        existing, new = [], []
+        for _, record in batch:
+            row = {column: record[column] for column in PRODUCT_COLUMNS if column != 'cloth_type_id'}
+            row['cloth_type_id'] = self.cloth_type_id(record['cloth_type'])
+            if record['id'] is not None:
+                existing.append((dict(row, id=record['id'], created_by=self.created_by, created_at=now),
+                                 record['sizes']))
+            else:
+                new.append((dict(row, created_by=self.created_by, created_at=now), record['sizes']))
+
+        if existing:
+            statement = insert(Product)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=[Product.id],
+                set_={column: statement.excluded[column] for column in PRODUCT_COLUMNS}
+            ), [row for row, _ in existing])
+        new_ids = []
+        if new:
+            new_ids = db.session.execute(
+                insert(Product).returning(Product.id, sort_by_parameter_order=True),
+                [row for row, _ in new]
+            ).scalars().all()
+
+        product_ids = [row['id'] for row, _ in existing] + list(new_ids)
+        size_rows = [
+            {'product_id': product_id, 'size_label': label, 'stock': stock}
+            for product_id, (_, sizes) in zip(product_ids, existing + new)
+            for label, stock in sizes.items()
+        ]
+        inventory.set_stock_many(size_rows)
+
+        mark_products_changed(product_ids)
+        reindex_products(product_ids)
+        db.session.commit()
+        return len(existing), len(new)
+
+    def summary(self):
+        return {
+            'created': self.created,
+            'upserted': self.upserted,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def import_catalog(stream, fmt, created_by=None, batch_size=BATCH_SIZE):
+    """Import a CSV/JSONL byte stream; returns counts and per-line errors."""
+    return CatalogImport(created_by, batch_size).run(read_records(stream, fmt))
+
+
+# ---------------- Exporting ----------------
+def export_records(batch_size=BATCH_SIZE):
+    """Yield one record per product in id order, streamed from the database."""
+    sizes = select(func.group_concat(ProductSize.size_label + ':' + cast(ProductSize.stock, String), ';')) \
+        .where(ProductSize.product_id == Product.id).scalar_subquery()
+    rows = db.session.execute(
+        select(Product, ClothType.type_name, sizes)
+        .outerjoin(ClothType, ClothType.id == Product.cloth_type_id)
+        .order_by(Product.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for product, type_name, size_list in rows:
+        yield {
+            'id': product.id,
+            'name': product.name,
+            'description': product.description or '',
+            'price': product.price,
+            'cloth_type': type_name or '',
+            'color': product.color or '',
+            'image_url': product.image_url or '',
+            'sizes': parse_sizes(size_list),
+        }
+
+
+def export_catalog(fmt, batch_size=BATCH_SIZE):
+    """Yield the catalog as CSV or JSONL text, a batch of rows per chunk."""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+        writer.writeheader()
+        write = lambda record: writer.writerow(
+            dict(record, sizes=';'.join(f'{label}:{stock}' for label, stock in record['sizes'].items())))
+    elif fmt == 'jsonl':
+        write = lambda record: buffer.write(json.dumps(record) + '\n')
+    else:
+        raise ValueError(f'Unknown format: {fmt}')
+
+    for count, record in enumerate(export_records(batch_size), 1):
+        write(record)
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,32 @@
+from . import db
+from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert
+
+
+class CatalogVersion(db.Model):
+    # Single row (id=1) bumped whenever products, sizes, reviews or cloth
+    # types change; used for ETag / Last-Modified on catalog responses
+    __bind_key__ = 'db'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.TIMESTAMP, nullable=False, default=datetime.now)
+
+
+def ensure_catalog_version():
+    db.session.execute(
+        insert(CatalogVersion).values(id=1, version=1, updated_at=datetime.now()).on_conflict_do_nothing()
+    )
+
+
+def current_catalog_version():
+    """(version, updated_at) of the catalog."""
+    return db.session.query(CatalogVersion.version, CatalogVersion.updated_at).filter_by(id=1).one()
+
+
+def bump_catalog_version():
+    db.session.execute(
+        update(CatalogVersion).where(CatalogVersion.id == 1)
+        .values(version=CatalogVersion.version + 1, updated_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
@@ -4,5 +4,5 @@ from sqlalchemy import Sequence
 class ClothType(db.Model):
     __bind_key__ = 'db'
     id = db.Column(db.Integer, Sequence('ClothType_sequence'), unique=True, nullable=False, primary_key=True)
-    type_name = db.Column(db.String(100), nullable=False)
+    type_name = db.Column(db.String(100), nullable=False, index=True)
     description = db.Column(db.String(255))
\ No newline at end of file
@@ -0,0 +1,60 @@
+from . import db
+from datetime import datetime, timedelta
+from sqlalchemy import Sequence, UniqueConstraint, delete, select
+from sqlalchemy.dialects.sqlite import insert
+
+
+class IdempotencyKey(db.Model):
+    # One row per (user, Idempotency-Key): claimed before a checkout runs,
+    # then holding its response so a retry can be answered from here
+    __bind_key__ = 'db'
+    __table_args__ = (UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_id_key'),)
+    id = db.Column(db.Integer, Sequence('IdempotencyKey_sequence'), unique=True, nullable=False, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, default=0)   # 0 for anonymous requests
+    key = db.Column(db.String(100), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)                          # NULL while the request is running
+    response_body = db.Column(db.Text)
+    mimetype = db.Column(db.String(100))
+    created_at = db.Column(db.TIMESTAMP, nullable=False, default=datetime.now, index=True)
+
+
+def claim_key(user_id, key, request_hash):
+    """Insert the key in the current transaction; False if it already exists.
+
+    Being the transaction's first statement, the insert also makes it a
+    writer from the start.
+    """
+    result = db.session.execute(
+        insert(IdempotencyKey).values(user_id=user_id, key=key, request_hash=request_hash,
+                                      created_at=datetime.now())
+        .on_conflict_do_nothing()
+    )
+    return result.rowcount == 1
+
+
+def find_key(user_id, key):
+    return db.session.execute(
+        select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+    ).scalar_one_or_none()
+
+
+def save_response(user_id, key, request_hash, status_code, body, mimetype):
+    # The claim is gone if the request rolled back, so insert or update
+    statement = insert(IdempotencyKey).values(
+        user_id=user_id, key=key, request_hash=request_hash, status_code=status_code,
+        response_body=body, mimetype=mimetype, created_at=datetime.now()
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[IdempotencyKey.user_id, IdempotencyKey.key],
+        set_={'status_code': statement.excluded.status_code,
+              'response_body': statement.excluded.response_body,
+              'mimetype': statement.excluded.mimetype}
+    ))
+
+
+def purge_expired_keys(ttl_seconds):
+    result = db.session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.created_at < datetime.now() - timedelta(seconds=ttl_seconds))
+    )
+    return result.rowcount
@@ -0,0 +1,153 @@
+"""Per-request SQL statistics and a slow-query log.
+
+Engine events time every statement. While a request is running, its
+statements are counted on ``g``. When the request ends, the totals are
+folded into per-endpoint stats: requests, queries, DB time, and the
+slowest statements seen. Statements slower than SQL_SLOW_QUERY_MS are
+logged with their EXPLAIN QUERY PLAN.
+
+Stats are kept per worker process.
+"""
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+INSTRUMENTATION_DEFAULTS = {
+    'SQL_STATS_ENABLED': True,
+    'SQL_SLOW_QUERY_MS': 100,
+    'SQL_SLOWEST_PER_ENDPOINT': 5,
+}
+
+# Statements worth explaining; PRAGMA, BEGIN etc. are not
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class EndpointStats:
+    def __init__(self, keep_slowest):
+        self.keep_slowest = keep_slowest
+        self.endpoints = {}   # endpoint -> dict of totals
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, queries):
+        # queries: [(elapsed_ms, statement)] issued by one request
+        with self.lock:
+            entry = self.endpoints.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'db_time_ms': 0.0, 'max_queries': 0, 'slowest': []
+            })
+            entry['requests'] += 1
+            entry['queries'] += len(queries)
+            entry['db_time_ms'] += sum(ms for ms, _ in queries)
+            entry['max_queries'] = max(entry['max_queries'], len(queries))
+            slowest = entry['slowest'] + sorted(queries, reverse=True)[:self.keep_slowest]
+            entry['slowest'] = sorted(slowest, reverse=True)[:self.keep_slowest]
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                endpoint: {
+                    'requests': e['requests'],
+                    'queries': e['queries'],
+                    'avg_queries': round(e['queries'] / e['requests'], 2),
+                    'max_queries': e['max_queries'],
+                    'db_time_ms': round(e['db_time_ms'], 2),
+                    'avg_db_time_ms': round(e['db_time_ms'] / e['requests'], 2),
+                    'slowest': [{'ms': round(ms, 2), 'statement': sql} for ms, sql in e['slowest']],
+                }
+                for endpoint, e in self.endpoints.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+def init_app(app, engines):
+    for key, default in INSTRUMENTATION_DEFAULTS.items():
+        app.config.setdefault(key, default)
+    if not app.config['SQL_STATS_ENABLED']:
+        return
+
+    stats = EndpointStats(app.config['SQL_SLOWEST_PER_ENDPOINT'])
+    app.extensions['sql_stats'] = stats
+    slow_ms = app.config['SQL_SLOW_QUERY_MS']
+
+    for engine in engines:
+        instrument_engine(app, engine, slow_ms)
+
+    @app.before_request
+    def start_sql_stats():
+        g.sql_queries = []
+
+    @app.after_request
+    def note_streaming(response):
+        # A streamed body runs its queries after the view returns: the
+        # request context is torn down once now and again when the stream
+        # ends, and only the second teardown has the full count
+        if response.is_streamed:
+            g.sql_streaming = True
+        return response
+
+    @app.teardown_request
+    def record_sql_stats(exc):
+        if g.pop('sql_streaming', False):
+            return
+        queries = g.pop('sql_queries', None)
+        if queries is not None and request.endpoint:
+            stats.record(request.endpoint, queries)
+
+
+def instrument_engine(app, engine, slow_ms):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+        if has_request_context() and 'sql_queries' in g:
+            g.sql_queries.append((elapsed_ms, statement))
+        if elapsed_ms >= slow_ms:
+            app.logger.warning('Slow query (%.1f ms): %s %r\n%s', elapsed_ms, statement,
+                               parameters, explain(conn, statement, parameters, executemany))
+
+    @event.listens_for(engine, 'handle_error')
+    def drop_timer(context):
+        # A failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
+
+
+def explain(conn, statement, parameters, executemany):
+    """EXPLAIN QUERY PLAN as indented text, or a note why there is none."""
+    if executemany or not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return '(no plan)'
+    # A separate cursor: the one that ran the statement may still hold rows
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        rows = cursor.fetchall()
+    except Exception as e:
+        return f'(no plan: {e})'
+    finally:
+        cursor.close()
+
+    # Rows are (id, parent, notused, detail); indent children under parents
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * (depth[node_id] + 1) + detail)
+    return '\n'.join(lines)
+
+
+def stats():
+    recorder = current_app.extensions.get('sql_stats')
+    return recorder.snapshot() if recorder is not None else {}
+
+
+def reset():
+    recorder = current_app.extensions.get('sql_stats')
+    if recorder is not None:
+        recorder.reset()
@@ -0,0 +1,190 @@
+"""All changes to ProductSize.stock go through here.
+
+Every mutation is a single SQL statement evaluated by SQLite, never a
+read-modify-write in Python, so concurrent workers cannot oversell or lose
+a restore. Product.total_stock is kept in step in the same transaction.
+Functions only add statements to the current session; callers commit, or
+roll back when a function reports failure.
+"""
+import secrets
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert
+
+from . import db
+from .aggregates import adjust_total_stock, refresh_total_stock
+from .order_item import OrderItem
+from .product_size import ProductSize
+from .stock_reservation import StockReservation
+
+RESERVATION_TTL_SECONDS = 15 * 60
+
+
+def take_stock(product_id, size_label, quantity):
+    """Decrement stock if at least ``quantity`` is left. Returns True on success."""
+    if quantity < 1:
+        return False
+    result = db.session.execute(
+        update(ProductSize)
+        .where(ProductSize.product_id == product_id,
+               ProductSize.size_label == size_label,
+               ProductSize.stock >= quantity)
+        .values(stock=ProductSize.stock - quantity)
+    )
+    if result.rowcount != 1:
+        return False
+    adjust_total_stock(product_id, -quantity)
+    return True
+
+
+def take_lines(lines):
+    """Take stock for ``{(product_id, size_label): quantity}``.
+
+    Returns None on success, or the first (product_id, size_label) that
+    could not be filled; the caller must then roll back.
+    """
+    # Stock held by carts that were abandoned is available again
+    release_expired_reservations()
+    for (product_id, size_label), quantity in lines.items():
+        if not take_stock(product_id, size_label, quantity):
+            return product_id, size_label
+    return None
+
+
+def restore_stock(product_id, size_label, quantity):
+    db.session.execute(
+        update(ProductSize)
+        .where(ProductSize.product_id == product_id, ProductSize.size_label == size_label)
+        .values(stock=ProductSize.stock + quantity)
+    )
+    refresh_total_stock([product_id])
+
+
+def restore_order_stock(order_id):
+    """Put back the stock of every line of an order in one statement."""
+    ordered = select(func.sum(OrderItem.quantity)).where(
+        OrderItem.order_id == order_id,
+        OrderItem.product_id == ProductSize.product_id,
+        OrderItem.size_label == ProductSize.size_label
+    ).scalar_subquery()
+    order_sizes = select(OrderItem.product_id, OrderItem.size_label).where(OrderItem.order_id == order_id)
+    db.session.execute(
+        update(ProductSize)
+        .where(tuple_(ProductSize.product_id, ProductSize.size_label).in_(order_sizes))
+        .values(stock=ProductSize.stock + ordered)
+        .execution_options(synchronize_session=False)
+    )
+    refresh_total_stock(select(OrderItem.product_id).where(OrderItem.order_id == order_id))
+
+
+def set_stock(product_id, size_label, stock):
+    """Set the absolute stock of a size, creating the size row if needed."""
+    statement = insert(ProductSize).values(product_id=product_id, size_label=size_label, stock=stock)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[ProductSize.product_id, ProductSize.size_label],
+        set_={'stock': statement.excluded.stock}
+    ))
+    refresh_total_stock([product_id])
+
+
+def set_stock_many(rows):
+    """set_stock() for many ``{'product_id', 'size_label', 'stock'}`` rows in one executemany."""
+    if not rows:
+        return
+    statement = insert(ProductSize)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[ProductSize.product_id, ProductSize.size_label],
+        set_={'stock': statement.excluded.stock}
+    ), rows)
+    refresh_total_stock(list({row['product_id'] for row in rows}))
+
+
+# ---------------- Reservations ----------------
+def reserve_lines(lines, user_id, ttl=None):
+    """Hold stock for a cart until it is checked out or the hold expires.
+
+    Returns (token, expires_at), or (None, failed_line) if some line could
+    not be filled, in which case the caller must roll back.
+    """
+    failed = take_lines(lines)
+    if failed:
+        return None, failed
+
+    if ttl is None:
+        ttl = current_app.config.get('RESERVATION_TTL_SECONDS', RESERVATION_TTL_SECONDS)
+    token = secrets.token_urlsafe(24)
+    expires_at = datetime.now() + timedelta(seconds=ttl)
+    db.session.add_all([StockReservation(
+        token=token,
+        user_id=user_id,
+        product_id=product_id,
+        size_label=size_label,
+        quantity=quantity,
+        expires_at=expires_at
+    ) for (product_id, size_label), quantity in lines.items()])
+    return token, expires_at
+
+
+def confirm_reservation(token, user_id):
+    """Turn a live reservation into a sale; the stock stays taken.
+
+    Returns the reserved ``{(product_id, size_label): quantity}``, or None
+    if the reservation is unknown, expired or already released.
+    """
+    live = and_(StockReservation.token == token,
+                StockReservation.user_id == user_id,
+                StockReservation.expires_at > datetime.now())
+    rows = db.session.execute(
+        select(StockReservation.product_id, StockReservation.size_label, StockReservation.quantity).where(live)
+    ).all()
+    if not rows:
+        return None
+
+    # Another worker may have released it between the read and the delete
+    result = db.session.execute(
+        delete(StockReservation).where(live).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(rows):
+        return None
+
+    lines = {}
+    for product_id, size_label, quantity in rows:
+        lines[(product_id, size_label)] = lines.get((product_id, size_label), 0) + quantity
+    return lines
+
+
+def _release(condition):
+    held = select(func.sum(StockReservation.quantity)).where(
+        condition,
+        StockReservation.product_id == ProductSize.product_id,
+        StockReservation.size_label == ProductSize.size_label
+    ).scalar_subquery()
+    held_sizes = select(StockReservation.product_id, StockReservation.size_label).where(condition)
+    db.session.execute(
+        update(ProductSize)
+        .where(tuple_(ProductSize.product_id, ProductSize.size_label).in_(held_sizes))
+        .values(stock=ProductSize.stock + held)
+        .execution_options(synchronize_session=False)
+    )
+    refresh_total_stock(select(StockReservation.product_id).where(condition))
+    result = db.session.execute(
+        delete(StockReservation).where(condition).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def release_reservation(token, user_id):
+    """Give a reservation's stock back. Returns the number of lines released."""
+    return _release(and_(StockReservation.token == token, StockReservation.user_id == user_id))
+
+
+def release_expired_reservations(now=None):
+    """Give back the stock of every expired reservation. Returns lines released."""
+    expired = StockReservation.expires_at <= (now or datetime.now())
+    # Usually nothing has expired: looking first keeps this from taking the
+    # write lock, so read-only callers such as the cart quote stay readers
+    if db.session.execute(select(StockReservation.id).where(expired).limit(1)).first() is None:
+        return 0
+    return _release(expired)
@@ -0,0 +1,172 @@
+import re
+
+from sqlalchemy import UniqueConstraint
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+
+from . import db
+
+# Rows that would violate the new unique (product_id, size_label) constraint
+# are merged into the oldest row, keeping the combined stock.
+MERGED_COPIES = {
+    'product_size': (
+        "SELECT min(id) AS id, product_id, size_label, sum(stock) AS stock FROM product_size "
+        "GROUP BY product_id, size_label"
+    ),
+}
+
+
+# Tables whose old rows move to the attached archive (see models/archive.py)
+ARCHIVED_TABLES = ('order', 'order_item')
+
+
+def _models():
+    from .user import User
+    from .cloth_type import ClothType
+    from .product import Product
+    from .product_size import ProductSize
+    from .order import Order
+    from .order_item import OrderItem
+    from .review import Review
+    from .stock_reservation import StockReservation
+    from .catalog_version import CatalogVersion
+    from .idempotency_key import IdempotencyKey
+    from .recommendations import ProductCoPurchase, ProductRecommendation
+    from .sales_rollups import DailySales
+    return [User, ClothType, Product, ProductSize, Order, OrderItem, Review, StockReservation,
+            CatalogVersion, IdempotencyKey, ProductCoPurchase, ProductRecommendation, DailySales]
+
+
+def _add_missing_columns(conn, dialect, table):
+    # New nullable or server-defaulted columns can be added in place
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table.name}")').fetchall()}
+    added = []
+    for column in table.columns:
+        if column.name not in existing:
+            ddl = str(CreateColumn(column).compile(dialect=dialect))
+            conn.execute(f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}')
+            added.append(column.name)
+    return added
+
+
+def _needs_rebuild(conn, table):
+    existing = conn.execute(f'PRAGMA foreign_key_list("{table.name}")').fetchall()
+    unique = [
+        row for row in conn.execute(f'PRAGMA index_list("{table.name}")').fetchall()
+        if row[3] == 'u'
+    ]
+    expected_unique = [c for c in table.constraints if isinstance(c, UniqueConstraint)]
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)).fetchone()
+    missing_autoincrement = table.dialect_options['sqlite']['autoincrement'] \
+        and 'AUTOINCREMENT' not in (sql[0] if sql else '').upper()
+    return len(existing) < len(table.foreign_keys) or len(unique) < len(expected_unique) or missing_autoincrement
+
+
+def _seed_past_archive(conn, table):
+    # Ids handed out before AUTOINCREMENT may already be in the archive; the
+    # next new row must get a larger id than any of them
+    archived = conn.execute(f'SELECT max(id) FROM archive."{table.name}"').fetchone()[0]
+    if archived is None:
+        return
+    updated = conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?',
+                           (archived, table.name, archived)).rowcount
+    if not updated and not conn.execute('SELECT 1 FROM sqlite_sequence WHERE name = ?', (table.name,)).fetchone():
+        conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table.name, archived))
+
+
+def _copy_source(table):
+    if table.name in MERGED_COPIES:
+        return f'({MERGED_COPIES[table.name]}) AS merged'
+    return f'"{table.name}"'
+
+
+def _copy_select(table):
+    # Drop rows whose CASCADE parent is gone and null out dangling SET NULL
+    # references, so the rebuilt table passes foreign_key_check
+    columns = []
+    conditions = []
+    for column in table.columns:
+        fk = next(iter(column.foreign_keys), None)
+        if fk is None:
+            columns.append(f'"{column.name}"')
+            continue
+        parent = f'SELECT "{fk.column.name}" FROM "{fk.column.table.name}"'
+        if fk.ondelete == 'CASCADE':
+            columns.append(f'"{column.name}"')
+            conditions.append(f'("{column.name}" IS NULL OR "{column.name}" IN ({parent}))')
+        else:
+            columns.append(f'CASE WHEN "{column.name}" IN ({parent}) THEN "{column.name}" END')
+
+    sql = f'SELECT {", ".join(columns)} FROM {_copy_source(table)}'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return sql
+
+
+def _rebuild_table(conn, dialect, table):
+    # SQLite cannot add constraints with ALTER TABLE: create the new shape,
+    # copy, drop the old table and rename (https://sqlite.org/lang_altertable.html).
+    # Returns the number of orphaned rows left behind by the copy
+    new_name = f'{table.name}_new'
+    ddl = str(CreateTable(table).compile(dialect=dialect))
+    ddl = re.sub(r'^\s*CREATE TABLE ("?)' + re.escape(table.name) + r'\1',
+                 f'CREATE TABLE "{new_name}"', ddl, count=1)
+    column_list = ', '.join(f'"{name}"' for name in table.columns.keys())
+
+    conn.execute(f'DROP TABLE IF EXISTS "{new_name}"')
+    conn.execute(ddl)
+    rows = conn.execute(f'SELECT count(*) FROM {_copy_source(table)}').fetchone()[0]
+    copied = conn.execute(f'INSERT INTO "{new_name}" ({column_list}) {_copy_select(table)}').rowcount
+    conn.execute(f'DROP TABLE "{table.name}"')
+    conn.execute(f'ALTER TABLE "{new_name}" RENAME TO "{table.name}"')
+    return rows - copied
+
+
+def upgrade_schema(app):
+    """Bring an existing database up to the current columns, indexes and foreign keys.
+
+    Safe to run on every start: tables that already have their constraints
+    are left alone and indexes are created with IF NOT EXISTS.
+    """
+    from .product import Product
+
+    engine = db.session.get_bind(mapper=Product)
+    added = {}
+    raw = engine.raw_connection()
+    conn = raw.driver_connection
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # manual BEGIN/COMMIT around the DDL
+    try:
+        conn.execute('PRAGMA foreign_keys=OFF')
+        conn.execute('BEGIN')
+        try:
+            for model in _models():
+                table = model.__table__
+                added[table.name] = _add_missing_columns(conn, engine.dialect, table)
+                if _needs_rebuild(conn, table):
+                    app.logger.info('Rebuilding table %s with constraints', table.name)
+                    dropped = _rebuild_table(conn, engine.dialect, table)
+                    if dropped:
+                        app.logger.warning('Dropped %d rows of %s whose parent row no longer exists',
+                                           dropped, table.name)
+                for index in table.indexes:
+                    conn.execute(str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect)))
+                if table.name in ARCHIVED_TABLES:
+                    _seed_past_archive(conn, table)
+            problems = conn.execute('PRAGMA foreign_key_check').fetchall()
+            if problems:
+                raise RuntimeError(f'Foreign key violations after upgrade: {problems[:10]}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.isolation_level = isolation_level
+        raw.close()
+
+    if added.get('product'):
+        # Backfill aggregate columns that were just added to existing rows
+        from .aggregates import recompute_all
+        app.logger.info('Backfilling product columns %s', added['product'])
+        recompute_all()
+        db.session.commit()
@@ -1,12 +1,20 @@
 from . import db
-from sqlalchemy import Sequence
+from sqlalchemy import Sequence, func
 from datetime import datetime
 
 
 class Order(db.Model):
     __bind_key__ = 'db'
+    # Ids are never reused, even after the newest orders are archived
+    __table_args__ = {'sqlite_autoincrement': True}
     id = db.Column(db.Integer, Sequence('Order_sequence'), unique=True, nullable=False, primary_key=True)
-    user_id = db.Column(db.Integer)
-    order_date = db.Column(db.TIMESTAMP, default=datetime.now)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    order_date = db.Column(db.TIMESTAMP, default=datetime.now, index=True)
     total_amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(50), nullable=False)
+
+
+# A customer's order history, newest first
+db.Index('ix_order_user_id_order_date', Order.user_id, Order.order_date.desc())
+# Admin order list filtered by status (normalized the way the routes compare it)
+db.Index('ix_order_status_order_date', func.lower(func.trim(Order.status)), Order.order_date.desc())
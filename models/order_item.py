@@ -3,9 +3,10 @@ from sqlalchemy import Sequence
 
 class OrderItem(db.Model):
     __bind_key__ = 'db'
+    __table_args__ = {'sqlite_autoincrement': True}   # see Order
     id = db.Column(db.Integer, Sequence('OrderItem_sequence'), unique=True, nullable=False, primary_key=True)
-    order_id = db.Column(db.Integer)
-    product_id = db.Column(db.Integer)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id', ondelete='CASCADE'), index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='SET NULL'), index=True)
     size_label = db.Column(db.String(10))
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
\ No newline at end of file
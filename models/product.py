@@ -9,8 +9,19 @@ class Product(db.Model):
     name = db.Column(db.String(150), nullable=False)
     description = db.Column(db.String(255))
     price = db.Column(db.Float, nullable=False)
-    cloth_type_id = db.Column(db.Integer)
+    cloth_type_id = db.Column(db.Integer, db.ForeignKey('cloth_type.id', ondelete='SET NULL'), index=True)
     color = db.Column(db.String(50))
     image_url = db.Column(db.String(255))
     created_by = db.Column(db.Integer)
-    created_at = db.Column(db.TIMESTAMP, default=datetime.now)
+    created_at = db.Column(db.TIMESTAMP, default=datetime.now, index=True)
+
+    # Denormalized aggregates, maintained by models.aggregates
+    total_stock = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @property
+    def rating_avg(self):
+        if not self.review_count:
+            return None
+        return round(self.rating_sum / self.review_count, 1)
@@ -4,7 +4,10 @@ from sqlalchemy import Sequence
 
 class ProductSize(db.Model):
     __bind_key__ = 'db'
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'size_label', name='uq_product_size_product_id_size_label'),
+    )
     id = db.Column(db.Integer, Sequence('ProductSize_sequence'), unique=True, nullable=False, primary_key=True)
-    product_id = db.Column(db.Integer)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'))
     size_label = db.Column(db.String(10))  # e.g., S, M, L, XL
     stock = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,165 @@
+"""'Frequently bought together' recommendations from order history.
+
+product_co_purchase is the sparse item-item co-occurrence matrix. It
+holds one row per ordered pair of products, with the number of orders
+that contain both. product_recommendation keeps the top K of each
+product's row, ranked. The product page reads it with one primary-key
+range lookup.
+
+record_order() updates both tables within the order's own
+transaction: it increments the pairs the order adds, then re-ranks the
+products involved. rebuild_recommendations() recomputes everything. It
+builds the matrix with NumPy/SciPy as X.T @ X over a sparse orders x
+products matrix when they are installed, and with a SQL self-join of
+order_item otherwise. Both read archived orders as well.
+"""
+from flask import current_app
+from sqlalchemy import and_, delete, func, select, union
+from sqlalchemy.dialects.sqlite import insert
+
+from . import db
+from .archive import ArchivedOrderItem
+from .order_item import OrderItem
+from .product import Product
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional, only speeds up full rebuilds
+    np = sparse = None
+
+TOP_K = 8
+WRITE_CHUNK = 10000
+
+
+class ProductCoPurchase(db.Model):
+    __bind_key__ = 'db'
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ProductRecommendation(db.Model):
+    __bind_key__ = 'db'
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    recommended_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+
+
+def top_k():
+    return current_app.config.get('RECOMMENDATIONS_TOP_K', TOP_K)
+
+
+def record_order(order_id, product_ids):
+    """Count the co-purchases that adding ``product_ids`` to an order creates.
+
+    Call before the new OrderItems are added, in the same transaction.
+    """
+    existing = set(db.session.execute(
+        select(OrderItem.product_id).where(OrderItem.order_id == order_id, OrderItem.product_id.isnot(None))
+        .distinct()
+    ).scalars())
+    new = set(product_ids) - existing
+    if not new or len(existing | new) < 2:
+        return
+
+    # New x (new + existing) in both directions; existing pairs were counted before
+    pairs = [{'product_id': a, 'other_id': b, 'order_count': 1} for a in new for b in existing | new if a != b]
+    pairs += [{'product_id': b, 'other_id': a, 'order_count': 1} for a in new for b in existing]
+    db.session.execute(insert(ProductCoPurchase).on_conflict_do_update(
+        index_elements=[ProductCoPurchase.product_id, ProductCoPurchase.other_id],
+        set_={'order_count': ProductCoPurchase.order_count + 1}
+    ), pairs)
+    refresh_top_k(existing | new)
+
+
+def refresh_top_k(product_ids=None):
+    """Re-rank product_recommendation for ``product_ids`` (all products if None)."""
+    pairs = ProductCoPurchase
+    ranked = select(
+        pairs.product_id, pairs.other_id, pairs.order_count,
+        func.row_number().over(partition_by=pairs.product_id,
+                               order_by=(pairs.order_count.desc(), pairs.other_id)).label('rank')
+    )
+    clear = delete(ProductRecommendation)
+    if product_ids is not None:
+        ranked = ranked.where(pairs.product_id.in_(list(product_ids)))
+        clear = clear.where(ProductRecommendation.product_id.in_(list(product_ids)))
+    ranked = ranked.subquery()
+
+    db.session.execute(clear.execution_options(synchronize_session=False))
+    db.session.execute(insert(ProductRecommendation).from_select(
+        ['product_id', 'recommended_id', 'score', 'rank'],
+        select(ranked.c.product_id, ranked.c.other_id, ranked.c.order_count, ranked.c.rank)
+        .where(ranked.c.rank <= top_k())
+    ))
+
+
+def rebuild_recommendations():
+    """Recompute the co-occurrence matrix and every top-K list; returns the pair count."""
+    db.session.execute(delete(ProductCoPurchase))
+    if sparse is not None:
+        pair_count = _write_pairs_numpy()
+    else:
+        pair_count = _write_pairs_sql()
+    refresh_top_k()
+    return pair_count
+
+
+def _order_lines():
+    # Distinct (order, product) of hot and archived orders; UNION also drops
+    # the copies an interrupted archive run leaves in both
+    return union(*[
+        select(model.order_id, model.product_id)
+        .where(model.order_id.isnot(None), model.product_id.isnot(None))
+        for model in (OrderItem, ArchivedOrderItem)
+    ])
+
+
+def _write_pairs_numpy():
+    result = db.session.execute(_order_lines().execution_options(yield_per=WRITE_CHUNK))
+    chunks = [np.array(partition, dtype=np.int64) for partition in result.partitions()]
+    if not chunks:
+        return 0
+    lines = np.concatenate(chunks)
+
+    # Binary orders x products matrix; X.T @ X counts the orders per product pair
+    order_ids, order_index = np.unique(lines[:, 0], return_inverse=True)
+    product_ids, product_index = np.unique(lines[:, 1], return_inverse=True)
+    x = sparse.csr_matrix((np.ones(len(lines), dtype=np.int32), (order_index, product_index)),
+                          shape=(len(order_ids), len(product_ids)))
+    co = (x.T @ x).tocoo()
+    off_diagonal = co.row != co.col
+    rows = product_ids[co.row[off_diagonal]]
+    cols = product_ids[co.col[off_diagonal]]
+    counts = co.data[off_diagonal]
+
+    for start in range(0, len(rows), WRITE_CHUNK):
+        end = start + WRITE_CHUNK
+        db.session.execute(insert(ProductCoPurchase), [
+            {'product_id': int(a), 'other_id': int(b), 'order_count': int(n)}
+            for a, b, n in zip(rows[start:end], cols[start:end], counts[start:end])
+        ])
+    return len(rows)
+
+
+def _write_pairs_sql():
+    lines = _order_lines()
+    a, b = lines.subquery(), lines.subquery()
+    result = db.session.execute(insert(ProductCoPurchase).from_select(
+        ['product_id', 'other_id', 'order_count'],
+        select(a.c.product_id, b.c.product_id, func.count())
+        .select_from(a)
+        .join(b, and_(b.c.order_id == a.c.order_id, b.c.product_id != a.c.product_id))
+        .group_by(a.c.product_id, b.c.product_id)
+    ))
+    return result.rowcount
+
+
+def for_product(product_id):
+    """[(Product, score)] recommended for ``product_id``, best first."""
+    return db.session.query(Product, ProductRecommendation.score) \
+        .join(ProductRecommendation, ProductRecommendation.recommended_id == Product.id) \
+        .filter(ProductRecommendation.product_id == product_id) \
+        .order_by(ProductRecommendation.rank).all()
@@ -6,8 +6,8 @@ from datetime import datetime
 class Review(db.Model):
     __bind_key__ = 'db'
     id = db.Column(db.Integer, Sequence('Review_sequence'), unique=True, nullable=False, primary_key=True)
-    user_id = db.Column(db.Integer)
-    product_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), index=True)
     rating = db.Column(db.Integer)
     comment = db.Column(db.Text)
     review_date = db.Column(db.TIMESTAMP, default=datetime.now)
@@ -0,0 +1,175 @@
+"""Daily sales rollups per product, cloth type and size.
+
+daily_sales holds one row per (order day, product, size). Each row has
+the units and revenue ordered, and how much of that was later cancelled
+or delivered. Everything is attributed to the day the order was placed,
+so a day's figures only change when its own orders do.
+
+Rows are updated incrementally in the transaction that changes the
+orders: record_items() when order lines are added, and
+record_transition() when an order's status changes. backfill() rebuilds
+the table from order history, archived orders included, in batches of
+orders. sales_report()
+answers date-range reports from the rollups alone.
+"""
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+
+from . import db
+from .archive import ArchivedOrder, ArchivedOrderItem
+from .cloth_type import ClothType
+from .order import Order
+from .order_item import OrderItem
+from .product import Product
+
+BATCH_SIZE = 5000
+
+# Status -> (units column, revenue column). Every line counts as ordered;
+# these buckets say what became of it.
+BUCKETS = {
+    'cancelled': ('cancelled_units', 'cancelled_revenue'),
+    'delivered': ('delivered_units', 'delivered_revenue'),
+}
+ORDERED = ('units', 'revenue')
+MEASURES = ['units', 'revenue', 'cancelled_units', 'cancelled_revenue', 'delivered_units', 'delivered_revenue']
+
+
+class DailySales(db.Model):
+    # No foreign keys: sales history outlives deleted products and types
+    __bind_key__ = 'db'
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    size_label = db.Column(db.String(10), primary_key=True)
+    cloth_type_id = db.Column(db.Integer)
+    units = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    revenue = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    cancelled_units = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    cancelled_revenue = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    delivered_units = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    delivered_revenue = db.Column(db.Float, nullable=False, default=0, server_default='0')
+
+
+# Per-product reports over a date range
+db.Index('ix_daily_sales_product_id_day', DailySales.product_id, DailySales.day)
+
+
+def _status(value):
+    return (value or '').strip().lower()
+
+
+def _lines(order=Order, item=OrderItem):
+    # (day, product, type, size) of every order line; rows for deleted
+    # products cannot be attributed and are left out
+    key = [func.date(order.order_date), item.product_id, Product.cloth_type_id,
+           func.coalesce(item.size_label, '')]
+    return select(*key).select_from(item) \
+        .join(order, order.id == item.order_id) \
+        .outerjoin(Product, Product.id == item.product_id) \
+        .where(item.product_id.isnot(None)) \
+        .group_by(*key)
+
+
+def _add(query, columns):
+    """Upsert ``query`` rows into daily_sales, adding to ``columns``."""
+    statement = insert(DailySales).from_select(
+        ['day', 'product_id', 'cloth_type_id', 'size_label'] + columns, query)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[DailySales.day, DailySales.product_id, DailySales.size_label],
+        set_={column: getattr(DailySales, column) + statement.excluded[column] for column in columns}
+    ))
+
+
+def _amounts(negate=False, item=OrderItem):
+    amounts = [func.sum(item.quantity), func.sum(item.quantity * item.price)]
+    return [-amount for amount in amounts] if negate else amounts
+
+
+def record_items(item_ids):
+    """Count newly added order lines (already flushed) as ordered."""
+    if item_ids:
+        _add(_lines().add_columns(*_amounts()).where(OrderItem.id.in_(list(item_ids))), list(ORDERED))
+
+
+def record_transition(order_id, old_status, new_status):
+    """Move an order's lines from the ``old_status`` bucket to the ``new_status`` one."""
+    old, new = BUCKETS.get(_status(old_status)), BUCKETS.get(_status(new_status))
+    if old == new:
+        return
+    order_lines = _lines().where(OrderItem.order_id == order_id)
+    if old:
+        _add(order_lines.add_columns(*_amounts(negate=True)), list(old))
+    if new:
+        _add(order_lines.add_columns(*_amounts()), list(new))
+
+
+def backfill(batch_size=BATCH_SIZE, progress=None):
+    """Rebuild daily_sales from all orders, committing every ``batch_size`` orders.
+
+    Orders placed while this runs are counted by record_items() and are
+    not read twice. Cancelling or delivering an old order that has not
+    been reached yet can count it twice, and so can archive_orders()
+    moving one, so run it while orders are quiet. ``progress`` gets
+    (id reached, last id) for the hot orders, then for the archived ones.
+    """
+    sources = [(Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)]
+
+    # Read inside the delete's write transaction, so any order with a larger
+    # id commits afterwards and is recorded incrementally
+    db.session.execute(delete(DailySales))
+    last_ids = [db.session.execute(select(func.coalesce(func.max(order.id), 0))).scalar()
+                for order, _ in sources]
+    db.session.commit()
+
+    batches = 0
+    for (order, item), last_id in zip(sources, last_ids):
+        status = func.lower(func.trim(order.status))
+        quantity, amount = item.quantity, item.quantity * item.price
+        measures = _amounts(item=item) + [
+            func.sum(case((status == bucket, value), else_=0))
+            for bucket in BUCKETS for value in (quantity, amount)
+        ]
+        for start in range(0, last_id, batch_size):
+            end = min(start + batch_size, last_id)
+            _add(_lines(order, item).add_columns(*measures).where(order.id > start, order.id <= end), MEASURES)
+            db.session.commit()
+            batches += 1
+            if progress:
+                progress(end, last_id)
+    return batches
+
+
+# ---------------- Reports ----------------
+GROUPINGS = {
+    'day': lambda: [DailySales.day],
+    'product': lambda: [DailySales.product_id, Product.name],
+    'cloth_type': lambda: [DailySales.cloth_type_id, ClothType.type_name],
+    'size': lambda: [DailySales.size_label],
+}
+
+
+def sales_report(date_from, date_to, group_by='day', product_id=None, cloth_type_id=None):
+    """Totals between two dates (inclusive), one row per ``group_by`` value."""
+    keys = GROUPINGS[group_by]()
+    query = select(*keys, *[func.sum(getattr(DailySales, m)).label(m) for m in MEASURES]) \
+        .select_from(DailySales) \
+        .where(DailySales.day.between(date_from, date_to))
+    if group_by == 'product':
+        query = query.outerjoin(Product, Product.id == DailySales.product_id)
+    elif group_by == 'cloth_type':
+        query = query.outerjoin(ClothType, ClothType.id == DailySales.cloth_type_id)
+    if product_id is not None:
+        query = query.where(DailySales.product_id == product_id)
+    if cloth_type_id is not None:
+        query = query.where(DailySales.cloth_type_id == cloth_type_id)
+    rows = db.session.execute(query.group_by(*keys).order_by(*keys[:1])).all()
+
+    report = []
+    for row in rows:
+        values = row._mapping
+        entry = {key.key: values[key.key] for key in keys}
+        if group_by == 'day':
+            entry['day'] = entry['day'].isoformat()
+        entry.update({m: round(values[m] or 0, 2) for m in MEASURES})
+        entry['net_revenue'] = round(entry['revenue'] - entry['cancelled_revenue'], 2)
+        report.append(entry)
+    return report
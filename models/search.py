@@ -0,0 +1,118 @@
+import json
+import re
+
+from sqlalchemy.exc import OperationalError
+
+from . import db, run_sql
+
+# FTS5 table keyed by product id (rowid); type_name is copied from ClothType
+SEARCH_TABLE = 'product_search'
+
+fts_enabled = False
+
+
+def create_search_index(app):
+    global fts_enabled
+    try:
+        run_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+            "USING fts5(name, description, color, type_name, tokenize='unicode61')"
+        )
+        fts_enabled = True
+    except OperationalError:
+        # SQLite built without FTS5: /search falls back to LIKE matching
+        db.session.rollback()
+        app.logger.warning('FTS5 is not available, product search will use LIKE')
+
+
+def index_product(product, type_name):
+    if not fts_enabled:
+        return
+    run_sql(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id", {'id': product.id})
+    run_sql(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, color, type_name) "
+        "VALUES (:id, :name, :description, :color, :type_name)",
+        {
+            'id': product.id,
+            'name': product.name,
+            'description': product.description or '',
+            'color': product.color or '',
+            'type_name': type_name or '',
+        }
+    )
+
+
+def reindex_products(product_ids):
+    # Batch form of index_product, reading the products back from the tables
+    if not fts_enabled or not product_ids:
+        return
+    ids = json.dumps(list(product_ids))
+    run_sql(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN (SELECT value FROM json_each(:ids))", {'ids': ids})
+    run_sql(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, color, type_name) "
+        "SELECT p.id, p.name, coalesce(p.description, ''), coalesce(p.color, ''), "
+        "coalesce(t.type_name, '') "
+        "FROM product p LEFT JOIN cloth_type t ON t.id = p.cloth_type_id "
+        "WHERE p.id IN (SELECT value FROM json_each(:ids))",
+        {'ids': ids}
+    )
+
+
+def remove_product(product_id):
+    if not fts_enabled:
+        return
+    run_sql(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id", {'id': product_id})
+
+
+def reindex_cloth_type(cloth_type_id, type_name):
+    # Refresh type_name for every product of a renamed or deleted cloth type.
+    # Call before a delete: the foreign key nulls product.cloth_type_id.
+    if not fts_enabled:
+        return
+    run_sql(
+        f"UPDATE {SEARCH_TABLE} SET type_name = :type_name "
+        "WHERE rowid IN (SELECT id FROM product WHERE cloth_type_id = :type_id)",
+        {'type_id': cloth_type_id, 'type_name': type_name or ''}
+    )
+
+
+def rebuild_search_index():
+    if not fts_enabled:
+        return 0
+    run_sql(f"DELETE FROM {SEARCH_TABLE}")
+    result = run_sql(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, color, type_name) "
+        "SELECT p.id, p.name, coalesce(p.description, ''), coalesce(p.color, ''), "
+        "coalesce(t.type_name, '') "
+        "FROM product p LEFT JOIN cloth_type t ON t.id = p.cloth_type_id"
+    )
+    return result.rowcount
+
+
+def match_expression(query):
+    # Every word must match, each as a prefix: "blue sh" -> "blue"* "sh"*
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{w}"*' for w in words)
+
+
+def search_product_ids(query, limit=20):
+    """Product ids matching ``query``, best match first."""
+    expression = match_expression(query)
+    if not expression:
+        return []
+
+    if fts_enabled:
+        rows = run_sql(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :expr "
+            "ORDER BY rank LIMIT :limit",
+            {'expr': expression, 'limit': limit}
+        )
+    else:
+        rows = run_sql(
+            "SELECT p.id FROM product p LEFT JOIN cloth_type t ON t.id = p.cloth_type_id "
+            "WHERE p.name LIKE :pattern OR p.description LIKE :pattern "
+            "OR p.color LIKE :pattern OR t.type_name LIKE :pattern "
+            "ORDER BY p.id LIMIT :limit",
+            {'pattern': f'%{query.strip()}%', 'limit': limit}
+        )
+    return [row[0] for row in rows]
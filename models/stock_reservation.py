@@ -0,0 +1,13 @@
+from . import db
+from sqlalchemy import Sequence
+
+
+class StockReservation(db.Model):
+    __bind_key__ = 'db'
+    id = db.Column(db.Integer, Sequence('StockReservation_sequence'), unique=True, nullable=False, primary_key=True)
+    token = db.Column(db.String(64), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'))
+    size_label = db.Column(db.String(10))
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.TIMESTAMP, nullable=False, index=True)
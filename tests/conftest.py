@@ -0,0 +1,91 @@
+"""Shared fixtures: the app on a throwaway SQLite database.
+
+app.py configures itself at import time, so DATABASE_URL is pointed at a
+temporary file before it is imported. Every test starts from empty tables
+and an empty response cache.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_tmp_dir = tempfile.mkdtemp(prefix='clothing-store-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp_dir, 'store.sqlite')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as store  # noqa: E402
+import cache  # noqa: E402
+from models import db, instrumentation, run_sql, search  # noqa: E402
+from models.catalog_version import ensure_catalog_version  # noqa: E402
+from models.cloth_type import ClothType  # noqa: E402
+from models.product import Product  # noqa: E402
+from models.product_size import ProductSize  # noqa: E402
+from models.user import User  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    store.app.config['TESTING'] = True
+    return store.app
+
+
+@pytest.fixture(autouse=True)
+def clean_state(app):
+    with app.app_context():
+        yield
+        db.session.rollback()
+        for table in reversed(db.metadatas['db'].sorted_tables):
+            db.session.execute(table.delete())
+        if search.fts_enabled:
+            run_sql(f'DELETE FROM {search.SEARCH_TABLE}')
+        ensure_catalog_version()
+        db.session.commit()
+        backend = cache.backend()
+        if backend is not None:
+            backend.invalidate(set(backend.tags))
+        instrumentation.reset()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user):
+    with client.session_transaction() as session:
+        session['user_id'] = user.id
+        session['role'] = user.role
+
+
+def add_user(role='customer', email=None):
+    user = User(username=role, email=email or f'{role}{User.query.count()}@example.com',
+                password='x', role=role)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def add_products(count, sizes=('S', 'M', 'L'), stock=10, price=100.0):
+    """``count`` products, each with ``sizes`` in stock; returns their ids."""
+    cloth_type = ClothType(type_name='Shirt')
+    db.session.add(cloth_type)
+    db.session.flush()
+    products = [Product(name=f'Product {i}', description='Cotton', price=price, color='Blue',
+                        cloth_type_id=cloth_type.id, image_url='', total_stock=stock * len(sizes))
+                for i in range(count)]
+    db.session.add_all(products)
+    db.session.flush()
+    db.session.add_all([ProductSize(product_id=p.id, size_label=label, stock=stock)
+                        for p in products for label in sizes])
+    db.session.commit()
+    return [p.id for p in products]
+
+
+def query_count(client, url, endpoint, **kwargs):
+    """(response, number of SQL statements the request ran)."""
+    instrumentation.reset()
+    response = client.get(url, **kwargs)
+    response.get_data()   # streamed bodies run their queries while being read
+    response.close()
+    return response, instrumentation.stats()[endpoint]['queries']
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, text
+
+from conftest import add_products, add_user
+from models import db, sales_rollups, stats
+from models.archive import ArchivedOrder, ArchivedOrderItem, archive_orders
+from models.order import Order
+from models.order_item import OrderItem
+from models.recommendations import ProductCoPurchase, rebuild_recommendations
+from models.sales_rollups import DailySales
+
+LONG_AGO = datetime.now() - timedelta(days=400)
+
+
+def add_order(user, *product_ids, status='Delivered', order_date=LONG_AGO):
+    order = Order(user_id=user.id, order_date=order_date, total_amount=100.0 * len(product_ids),
+                  status=status)
+    db.session.add(order)
+    db.session.flush()
+    db.session.add_all([OrderItem(order_id=order.id, product_id=product_id, size_label='M',
+                                  quantity=1, price=100.0) for product_id in product_ids])
+    db.session.commit()
+    return order.id
+
+
+@pytest.fixture
+def customer():
+    return add_user()
+
+
+@pytest.fixture
+def product_id():
+    return add_products(1)[0]
+
+
+def test_new_order_never_reuses_an_archived_id(customer, product_id):
+    first = add_order(customer, product_id)
+    assert archive_orders() == 1
+
+    second = add_order(customer, product_id)
+    assert second > first
+    assert archive_orders() == 1
+
+    assert sorted(o.id for o in ArchivedOrder.query) == [first, second]
+    assert ArchivedOrderItem.query.count() == 2
+    assert Order.query.count() == 0
+
+
+def test_archive_refuses_to_drop_an_order_whose_id_is_taken(customer, product_id):
+    order_id = add_order(customer, product_id)
+    db.session.add(ArchivedOrder(id=order_id, user_id=customer.id, order_date=LONG_AGO,
+                                 total_amount=5.0, status='Cancelled'))
+    db.session.commit()
+
+    with pytest.raises(RuntimeError):
+        archive_orders()
+    assert db.session.get(Order, order_id).total_amount == 100.0
+    assert OrderItem.query.filter_by(order_id=order_id).count() == 1
+
+
+def test_leftover_copy_from_an_interrupted_run_is_finished(customer, product_id):
+    order_id = add_order(customer, product_id)
+    # What a crash between the two files' commits leaves behind
+    db.session.execute(text('INSERT INTO archive."order" SELECT * FROM "order"'))
+    db.session.execute(text('INSERT INTO archive.order_item SELECT * FROM order_item'))
+    db.session.commit()
+
+    assert archive_orders() == 1
+    assert Order.query.count() == 0
+    assert db.session.get(ArchivedOrder, order_id).total_amount == 100.0
+
+
+def test_recent_and_pending_orders_stay(customer, product_id):
+    add_order(customer, product_id, status='Pending')
+    add_order(customer, product_id, order_date=datetime.now())
+    assert archive_orders() == 0
+    assert Order.query.count() == 2
+
+
+@pytest.fixture
+def one_archived_one_hot(customer):
+    shirt, jeans = add_products(2)
+    add_order(customer, shirt, jeans)
+    archive_orders()
+    add_order(customer, shirt, order_date=datetime.now())
+    return shirt, jeans
+
+
+def test_backfill_counts_archived_orders(one_archived_one_hot):
+    sales_rollups.backfill(batch_size=1)
+    assert db.session.query(func.sum(DailySales.delivered_units)).scalar() == 3
+
+
+def test_recommendations_count_archived_orders(one_archived_one_hot, monkeypatch):
+    shirt, jeans = one_archived_one_hot
+    monkeypatch.setattr('models.recommendations.sparse', None)
+    rebuild_recommendations()
+    assert db.session.get(ProductCoPurchase, (shirt, jeans)).order_count == 1
+
+
+def test_revenue_by_period_counts_archived_orders(one_archived_one_hot):
+    periods = stats.revenue_by_period('day', LONG_AGO - timedelta(days=1))
+    assert [p['orders'] for p in periods] == [1, 1]
+    assert sum(p['revenue'] for p in periods) == 300.0
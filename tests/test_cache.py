@@ -0,0 +1,41 @@
+from conftest import add_products, add_user, login
+from models import db
+from models.catalog_version import bump_catalog_version
+from models.product import Product
+from models.recommendations import ProductRecommendation
+
+
+def change_price_elsewhere(product_id, price):
+    # What another worker's write looks like here: the row and the catalog
+    # version change, but this process's cache is never told
+    db.session.query(Product).filter_by(id=product_id).update({'price': price})
+    bump_catalog_version()
+    db.session.info.clear()
+    db.session.commit()
+
+
+def test_etag_always_matches_the_cached_body(client):
+    [product_id] = add_products(1, price=5.0)
+    first = client.get('/get_products')
+    assert first.get_json()[0]['price'] == 5.0
+
+    change_price_elsewhere(product_id, 10.0)
+    second = client.get('/get_products')
+    assert second.get_json()[0]['price'] == 10.0
+    assert second.headers['ETag'] != first.headers['ETag']
+
+    revalidated = client.get('/get_products', headers={'If-None-Match': second.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_product_page_drops_a_deleted_recommendation(app, client):
+    # Deleting B only invalidates B's tags, yet A's page lists B
+    shown, deleted = add_products(2)
+    db.session.add(ProductRecommendation(product_id=shown, rank=1, recommended_id=deleted, score=3))
+    db.session.commit()
+    assert b'Product 1' in client.get(f'/product_details/{shown}').data
+
+    admin = app.test_client()
+    login(admin, add_user('admin'))
+    admin.post('/admin/delete_product', data={'product_id': deleted})
+    assert b'Product 1' not in client.get(f'/product_details/{shown}').data
@@ -0,0 +1,40 @@
+import io
+
+from models import db, run_sql
+from models.catalog_io import import_catalog
+from models.product import Product
+from models.product_size import ProductSize
+
+
+def run_import(text, fmt='csv', batch_size=1000):
+    return import_catalog(io.BytesIO(text.encode()), fmt, batch_size=batch_size)
+
+
+def test_import_sets_stock_and_total(app):
+    result = run_import('name,price,cloth_type,sizes\nLinen Shirt,25,Shirt,S:3;M:2\n')
+    assert result['created'] == 1 and result['error_count'] == 0
+
+    product = Product.query.one()
+    assert product.total_stock == 5
+    assert {s.size_label: s.stock for s in ProductSize.query} == {'S': 3, 'M': 2}
+
+    result = run_import(f'id,name,price,cloth_type,sizes\n{product.id},Linen Shirt,25,Shirt,M:7\n')
+    assert result['upserted'] == 1
+    db.session.expire_all()
+    assert product.total_stock == 10
+
+
+def test_rejected_row_does_not_sink_its_batch(app):
+    run_sql("CREATE TRIGGER reject_bad BEFORE INSERT ON product WHEN NEW.name = 'Bad' "
+            "BEGIN SELECT RAISE(ABORT, 'bad product'); END")
+    try:
+        result = run_import('name,price,cloth_type,sizes\n'
+                            'Good 1,10,Shirt,S:1\nBad,10,Shirt,S:1\nGood 2,10,Shirt,S:1\n')
+    finally:
+        run_sql('DROP TRIGGER reject_bad')
+
+    assert result['created'] == 2
+    assert [e['line'] for e in result['errors']] == [3]
+    assert 'bad product' in result['errors'][0]['error']
+    assert sorted(p.name for p in Product.query) == ['Good 1', 'Good 2']
+    assert ProductSize.query.count() == 2
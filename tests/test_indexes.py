@@ -0,0 +1,39 @@
+"""The hot lookups must be index searches, never table scans."""
+import pytest
+from sqlalchemy import func, select
+
+from models import db, instrumentation
+from models.order import Order
+from models.order_item import OrderItem
+from models.product import Product
+from models.product_size import ProductSize
+from models.review import Review
+
+
+def query_plan(statement):
+    connection = db.session.connection(bind_arguments={'mapper': Product})
+    compiled = statement.compile(dialect=connection.dialect)
+    parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+    return instrumentation.explain(connection, str(compiled), parameters, False)
+
+
+HOT_QUERIES = {
+    'order history': lambda: select(Order).where(Order.user_id == 1)
+    .order_by(Order.order_date.desc(), Order.id.desc()).limit(21),
+    'admin orders by status': lambda: select(Order)
+    .where(func.lower(func.trim(Order.status)) == 'pending')
+    .order_by(Order.order_date.desc()).limit(51),
+    'order lines': lambda: select(OrderItem).where(OrderItem.order_id == 1),
+    'reviews by product': lambda: select(Review).where(Review.product_id == 1)
+    .order_by(Review.id).limit(101),
+    'sizes of a product': lambda: select(ProductSize).where(ProductSize.product_id == 1),
+    'size lookup': lambda: select(ProductSize.stock)
+    .where(ProductSize.product_id == 1, ProductSize.size_label == 'M'),
+}
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_query_uses_an_index(app, name):
+    plan = query_plan(HOT_QUERIES[name]())
+    assert 'SCAN' not in plan, plan
+    assert 'USING INDEX' in plan or 'USING COVERING INDEX' in plan, plan
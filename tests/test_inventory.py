@@ -0,0 +1,74 @@
+import pytest
+
+from conftest import add_products, add_user, login
+from models import db, inventory
+from models.product_size import ProductSize
+
+
+def stock_of(product_id, size_label='M'):
+    db.session.expire_all()
+    return ProductSize.query.filter_by(product_id=product_id, size_label=size_label).one().stock
+
+
+@pytest.fixture
+def customer(client):
+    user = add_user('customer')
+    login(client, user)
+    return user
+
+
+@pytest.fixture
+def expired_hold(app, client, customer, monkeypatch):
+    """The only unit of size M, held by a cart reservation that has already expired."""
+    [product_id] = add_products(1, sizes=('M',), stock=1)
+    monkeypatch.setitem(app.config, 'RESERVATION_TTL_SECONDS', 0)
+    items = [{'product_id': product_id, 'size_label': 'M', 'quantity': 1}]
+    assert client.post('/reserve_cart', json={'items': items}).status_code == 200
+    assert stock_of(product_id) == 0
+    return product_id, items
+
+
+def test_quote_ignores_expired_holds(client, expired_hold):
+    product_id, items = expired_hold
+    quote = client.post('/cart/quote', json={'items': items}).get_json()
+    assert quote['can_checkout']
+    assert quote['lines'][0]['available'] == 1
+
+
+
+def test_quote_lines_in_error_have_no_total(client, customer):
+    [product_id, gone_id] = add_products(2, sizes=('M',), stock=2, price=30.0)
+    items = [{'product_id': product_id, 'size_label': 'M', 'quantity': 2},
+             {'product_id': product_id, 'size_label': 'M', 'quantity': 5},
+             {'product_id': gone_id, 'size_label': 'XL', 'quantity': 1}]
+    quote = client.post('/cart/quote', json={'items': items}).get_json()
+
+    assert [line['line_total'] for line in quote['lines']] == [60.0, None, None]
+    assert [line['error'] is None for line in quote['lines']] == [True, False, False]
+    assert quote['total'] == 60.0
+    assert not quote['can_checkout']
+
+
+def test_checkout_takes_stock_from_expired_holds(client, expired_hold):
+    product_id, items = expired_hold
+    response = client.post('/checkout', json={'items': items})
+    assert response.status_code == 200, response.get_json()
+    assert stock_of(product_id) == 0
+
+
+def test_take_stock_rejects_non_positive_quantities(app):
+    [product_id] = add_products(1, sizes=('M',), stock=5)
+    assert not inventory.take_stock(product_id, 'M', -3)
+    assert not inventory.take_stock(product_id, 'M', 0)
+    assert stock_of(product_id) == 5
+
+
+def test_add_order_items_rejects_negative_quantity(client, customer):
+    [product_id] = add_products(1, sizes=('M',), stock=5)
+    order_id = client.post('/add_order', json={'total_amount': 0}).get_json()['order_id']
+    response = client.post('/add_order_items', json={
+        'order_id': order_id,
+        'items': [{'product_id': product_id, 'size_label': 'M', 'quantity': -3}]
+    })
+    assert response.status_code == 400
+    assert stock_of(product_id) == 5
@@ -0,0 +1,36 @@
+import logging
+import sqlite3
+
+from flask import Flask
+
+import models
+
+# order_item and review as they were before the foreign keys
+OLD_SCHEMA = '''
+CREATE TABLE "order" (id INTEGER PRIMARY KEY, user_id INTEGER, order_date TIMESTAMP,
+                      total_amount FLOAT NOT NULL, status VARCHAR(50) NOT NULL);
+CREATE TABLE order_item (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER,
+                         size_label VARCHAR(10), quantity INTEGER NOT NULL, price FLOAT NOT NULL);
+CREATE TABLE review (id INTEGER PRIMARY KEY, product_id INTEGER, user_id INTEGER,
+                     rating INTEGER, comment TEXT, created_at TIMESTAMP);
+INSERT INTO "order" VALUES (1, NULL, '2024-01-01', 10, 'Delivered');
+INSERT INTO order_item VALUES (1, 1, NULL, 'M', 1, 10), (2, 99, NULL, 'M', 1, 10), (3, 98, NULL, 'S', 1, 10);
+INSERT INTO review VALUES (1, 42, NULL, 5, 'gone', '2024-01-01');
+'''
+
+
+def test_upgrade_reports_orphaned_rows_it_drops(tmp_path, caplog):
+    database = tmp_path / 'old.sqlite'
+    with sqlite3.connect(database) as conn:
+        conn.executescript(OLD_SCHEMA)
+
+    app = Flask(__name__)
+    app.config['DATABASE_URL'] = f'sqlite:///{database}'
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        models.init_app(app)
+
+    dropped = [r.getMessage() for r in caplog.records if r.getMessage().startswith('Dropped')]
+    assert dropped == ['Dropped 2 rows of order_item whose parent row no longer exists',
+                       'Dropped 1 rows of review whose parent row no longer exists']
+    with sqlite3.connect(database) as conn:
+        assert conn.execute('SELECT id FROM order_item').fetchall() == [(1,)]
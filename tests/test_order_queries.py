@@ -0,0 +1,49 @@
+"""Pages that used to run one query per row must stay at a fixed count."""
+from conftest import add_products, add_user, login, query_count
+from models import db
+from models.review import Review
+
+
+def place_order(client, product_ids):
+    items = [{'product_id': product_id, 'size_label': 'M', 'quantity': 1} for product_id in product_ids]
+    response = client.post('/checkout', json={'items': items})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['order_id']
+
+
+def test_order_details_query_count(client):
+    login(client, add_user('customer'))
+    small = place_order(client, add_products(1))
+    large = place_order(client, add_products(12))
+
+    response, few = query_count(client, f'/get_order_details/{small}', 'get_order_details')
+    assert response.status_code == 200
+    response, many = query_count(client, f'/get_order_details/{large}', 'get_order_details')
+    assert b'Product 11' in response.data
+    # The order, then its lines joined to their products
+    assert few == many == 2
+
+
+def test_get_product_sizes_query_count(client):
+    add_products(2)
+    response, few = query_count(client, '/get_product_sizes', 'get_product_sizes')
+    assert len(response.get_json()) == 6
+
+    add_products(20)
+    response, many = query_count(client, '/get_product_sizes', 'get_product_sizes')
+    assert len(response.get_json()) == 66
+    assert few == many == 1
+
+
+def test_product_details_query_count(client):
+    [product_id] = add_products(1, sizes=('S', 'M', 'L', 'XL'))
+    reviewers = [add_user('customer') for _ in range(5)]
+    db.session.add_all([Review(user_id=u.id, product_id=product_id, rating=4, comment='Nice')
+                        for u in reviewers])
+    db.session.commit()
+
+    response, count = query_count(client, f'/product_details/{product_id}', 'product_details')
+    assert response.status_code == 200
+    assert response.data.count(b'Nice') == 5
+    # Catalog version, product with type, sizes, reviews with authors, recommendations
+    assert count == 5
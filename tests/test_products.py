@@ -0,0 +1,23 @@
+from conftest import add_products, query_count
+
+
+def test_get_products_query_count_does_not_grow_with_catalog(client):
+    add_products(2)
+    response, few = query_count(client, '/get_products', 'get_products')
+    assert response.status_code == 200
+    assert len(response.get_json()) == 2
+
+    add_products(30)
+    client.application.extensions['response_cache'].invalidate({'catalog'})
+    response, many = query_count(client, '/get_products', 'get_products')
+    assert len(response.get_json()) == 32
+
+    # Catalog version for the ETag, then one joined query for the products
+    assert few == many == 2
+
+
+def test_get_products_reports_type_and_stock(client):
+    add_products(1, sizes=('S', 'M'), stock=4)
+    product = client.get('/get_products').get_json()[0]
+    assert product['cloth_type'] == 'Shirt'
+    assert product['total_stock'] == 8
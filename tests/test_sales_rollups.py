@@ -0,0 +1,68 @@
+from datetime import date
+
+import app as store
+from conftest import add_products, add_user, login
+from models import db, sales_rollups
+from models.sales_rollups import DailySales
+
+
+def totals():
+    db.session.expire_all()
+    row = db.session.query(DailySales).one()
+    return {m: getattr(row, m) for m in sales_rollups.MEASURES}
+
+
+def checkout(client, product_id, quantity=2):
+    items = [{'product_id': product_id, 'size_label': 'M', 'quantity': quantity}]
+    return client.post('/checkout', json={'items': items}).get_json()['order_id']
+
+
+def test_checkout_and_delivery_are_rolled_up(client):
+    login(client, add_user('customer'))
+    [product_id] = add_products(1, price=50.0)
+    order_id = checkout(client, product_id)
+    assert totals()['units'] == 2 and totals()['revenue'] == 100.0
+
+    assert client.post('/set_order_delivered', data={'order_id': order_id}).status_code == 200
+    assert client.post('/set_order_delivered', data={'order_id': order_id}).status_code == 200
+    assert totals()['delivered_units'] == 2
+
+    report = client.application.test_client()
+    login(report, add_user('admin'))
+    rows = report.get('/admin/sales_report?group_by=product').get_json()['rows']
+    assert rows[0]['delivered_revenue'] == 100.0
+
+
+def test_racing_deliveries_count_once(client):
+    login(client, add_user('customer'))
+    [product_id] = add_products(1)
+    order_id = checkout(client, product_id)
+
+    # Both requests read the order while it was still Pending
+    assert store.deliver_order(order_id, 'Pending')
+    assert not store.deliver_order(order_id, 'Pending')
+    assert totals()['delivered_units'] == 2
+
+
+def test_delivering_a_cancelled_order_moves_its_lines(client):
+    login(client, add_user('customer'))
+    [product_id] = add_products(1)
+    order_id = checkout(client, product_id)
+    client.post('/cancel_order', data={'order_id': order_id})
+    assert totals()['cancelled_units'] == 2
+
+    client.post('/set_order_delivered', data={'order_id': order_id})
+    assert totals()['cancelled_units'] == 0
+    assert totals()['delivered_units'] == 2
+
+
+def test_backfill_matches_incremental_rollups(client):
+    login(client, add_user('customer'))
+    [product_id] = add_products(1)
+    checkout(client, product_id)
+    client.post('/cancel_order', data={'order_id': checkout(client, product_id, 1)})
+    incremental = totals()
+
+    sales_rollups.backfill(batch_size=1)
+    assert totals() == incremental
+    assert db.session.query(DailySales.day).scalar() == date.today()
@@ -0,0 +1,46 @@
+import pytest
+
+from conftest import add_user, login
+from models.cloth_type import ClothType
+from models.product import Product
+from models.product_size import ProductSize
+from models import db, run_sql, search
+
+
+def add_product_form(cloth_type_id, **sizes):
+    form = {'name': 'Linen Shirt', 'description': 'Breezy', 'color': 'White', 'price': '25',
+            'cloth_type_id': str(cloth_type_id)}
+    form.update({f'size_{label}': value for label, value in sizes.items()})
+    return form
+
+
+@pytest.fixture
+def cloth_type_id():
+    cloth_type = ClothType(type_name='Shirt')
+    db.session.add(cloth_type)
+    db.session.commit()
+    return cloth_type.id
+
+
+def test_added_product_is_searchable(client, cloth_type_id):
+    login(client, add_user('admin'))
+    response = client.post('/admin/add_product', data=add_product_form(cloth_type_id, S='3', M='2'))
+    assert response.status_code == 302
+
+    results = client.get('/search?q=linen').get_json()
+    assert [p['name'] for p in results] == ['Linen Shirt']
+    assert results[0]['total_stock'] == 5
+
+
+@pytest.mark.parametrize('stock', ['lots', '-1', '2.5'])
+def test_add_product_rejects_a_bad_size_stock(client, cloth_type_id, stock):
+    login(client, add_user('admin'))
+    response = client.post('/admin/add_product', data=add_product_form(cloth_type_id, S='3', M=stock))
+    assert response.status_code == 400
+    assert 'M' in response.get_json()['error']
+
+    assert Product.query.count() == 0
+    assert ProductSize.query.count() == 0
+    if search.fts_enabled:
+        assert run_sql(f'SELECT count(*) FROM {search.SEARCH_TABLE}').scalar() == 0
+    assert client.get('/search?q=linen').get_json() == []